@@ -1,7 +1,9 @@
 from django.contrib import admin
+from django.utils import timezone
 
-from .models import (Favorite, Follow, Ingredient, IngredientAmount, Recipe,
-                     ShoppingCart, Tag)
+from .models import (ExportJob, Favorite, Follow, Ingredient, IngredientAmount,
+                     Recipe, RecipePopularity, RecipeSearch, ShoppingCart,
+                     ShoppingCartItem, Tag)
 
 
 class IngredientsAdmin(admin.ModelAdmin):
@@ -34,10 +36,32 @@ class FavoriteAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe')
 
 
+class RecipePopularityAdmin(admin.ModelAdmin):
+    list_display = ('recipe', 'score', 'favorites', 'cart_adds', 'dirty',
+                    'refreshed_at')
+    list_filter = ('dirty',)
+
+
 class IngredientAmountAdmin(admin.ModelAdmin):
     list_display = ('recipe', 'ingredient', 'amount')
     list_filter = ('ingredient',)
 
+    def delete_queryset(self, request, queryset):
+        amounts = list(queryset.values_list('recipe', 'ingredient', 'amount'))
+        super().delete_queryset(request, queryset)
+        recipes = {recipe for recipe, _, _ in amounts}
+        Recipe.objects.filter(pk__in=recipes).update(
+            updated_at=timezone.now())
+        for recipe, ingredient, amount in amounts:
+            ShoppingCartItem.objects.change_recipe(recipe,
+                                                   {ingredient: -amount})
+        RecipeSearch.objects.schedule(recipes)
+
+
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'status', 'created', 'finished_at')
+    list_filter = ('status',)
+
 
 admin.site.register(Ingredient, IngredientsAdmin)
 admin.site.register(IngredientAmount, IngredientAmountAdmin)
@@ -46,3 +70,5 @@ admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(Follow, FollowAdmin)
 admin.site.register(ShoppingCart, ShoppingCartAdmin)
 admin.site.register(Favorite, FavoriteAdmin)
+admin.site.register(RecipePopularity, RecipePopularityAdmin)
+admin.site.register(ExportJob, ExportJobAdmin)
@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.template.response import SimpleTemplateResponse
+
+from .profiling import capture_queries
+
+# В Django 3.2 нет асинхронного ORM, а синхронные представления под ASGI
+# выполняются в одном общем потоке. Читающие эндпоинты поэтому работают
+# в собственном ограниченном пуле потоков, а выгрузки - в отдельном,
+# чтобы медленный PDF не занимал потоки для списков рецептов.
+view_executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_VIEW_THREADS,
+    thread_name_prefix='api-view')
+export_executor = ThreadPoolExecutor(
+    max_workers=settings.EXPORT_THREADS,
+    thread_name_prefix='api-export')
+
+
+def run_view(view, request, *args, **kwargs):
+    # Потоки пула живут дольше запроса, поэтому соединения с базой
+    # проверяются здесь, как это делают сигналы request_started
+    # и request_finished для обычных запросов.
+    close_old_connections()
+    try:
+        with capture_queries():
+            response = view(request, *args, **kwargs)
+            if isinstance(response, SimpleTemplateResponse):
+                response.render()
+            return response
+    finally:
+        close_old_connections()
+
+
+def async_view(view, executor=view_executor):
+    """Асинхронная обертка синхронного представления для ASGI.
+
+    Ответ DRF рендерится в том же потоке пула, потоковые ответы должны
+    быть готовы к отдаче без обращений к базе.
+    """
+    run = sync_to_async(run_view, thread_sensitive=False, executor=executor)
+
+    async def wrapper(request, *args, **kwargs):
+        return await run(view, request, *args, **kwargs)
+
+    wrapper.csrf_exempt = getattr(view, 'csrf_exempt', False)
+    return wrapper
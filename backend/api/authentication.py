@@ -0,0 +1,71 @@
+import copy
+import hashlib
+import time
+
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.permissions import SAFE_METHODS
+
+from .cache import LRUCache, cache_is_shared
+
+TOKEN_KEY = 'auth:token:{digest}'
+
+
+def token_cache_key(key):
+    return TOKEN_KEY.format(digest=hashlib.sha256(key.encode()).hexdigest())
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication с кешированием токена и пользователя.
+
+    Токен сначала ищется в локальном кеше процесса, потом в общем кеше
+    Django и только затем в базе. Записи удаляются при удалении токена
+    и сохранении пользователя; локальный кеш живет несколько секунд,
+    поэтому другие процессы узнают об этом не позже. Общий кеш
+    используется, только если он действительно общий (CACHES): в
+    LocMemCache сброс из другого процесса не дошел бы до записи.
+
+    Изменяющие запросы всегда читают пользователя из базы: смена пароля
+    и профиля сохраняют request.user целиком, и экземпляр из кеша
+    вернул бы в базу устаревшие поля.
+    """
+    cache_timeout = 5 * 60
+    local_timeout = 5
+    local_cache = LRUCache(maxsize=1024)
+    use_cache = True
+
+    def authenticate(self, request):
+        self.use_cache = request.method in SAFE_METHODS
+        return super().authenticate(request)
+
+    def authenticate_credentials(self, key):
+        if not self.use_cache:
+            return super().authenticate_credentials(key)
+        cache_key = token_cache_key(key)
+        entry = self.local_cache.get(cache_key)
+        if entry is None or entry[0] < time.monotonic():
+            shared = cache_is_shared()
+            credentials = cache.get(cache_key) if shared else None
+            if credentials is None:
+                credentials = super().authenticate_credentials(key)
+                if shared:
+                    cache.set(cache_key, credentials, self.cache_timeout)
+            entry = (time.monotonic() + self.local_timeout, credentials)
+            self.local_cache.set(cache_key, entry)
+        # Объекты из локального кеша общие для всех потоков процесса.
+        token = copy.copy(entry[1][1])
+        token.user = copy.copy(token.user)
+        return token.user, token
+
+    @classmethod
+    def invalidate(cls, keys):
+        cache_keys = [token_cache_key(key) for key in keys]
+        cache.delete_many(cache_keys)
+        for cache_key in cache_keys:
+            cls.local_cache.delete(cache_key)
+
+    @classmethod
+    def invalidate_user(cls, user):
+        cls.invalidate(Token.objects.filter(user=user).values_list(
+            'key', flat=True))
@@ -0,0 +1,135 @@
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+VERSION_KEY = 'catalog:{name}:version'
+PAYLOAD_KEY = 'catalog:{name}:{version}'
+PAYLOAD_TIMEOUT = 60 * 60 * 24
+MEMBERSHIP_KEY = 'membership:{name}:{user_id}'
+# Сколько живет версия справочника, если кеш у каждого процесса свой.
+LOCAL_VERSION_TIMEOUT = 60
+
+
+def cache_is_shared():
+    # LocMemCache у каждого процесса свой: сброс в одном процессе
+    # не виден остальным.
+    return not isinstance(caches['default'], LocMemCache)
+
+
+def make_etag(content):
+    return f'"{hashlib.sha1(content).hexdigest()}"'
+
+
+class LRUCache:
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CatalogCache:
+    """Готовые JSON-ответы справочников с ETag.
+
+    Версия справочника хранится в кеше Django, а локальный LRU избавляет
+    от повторной загрузки тела ответа из кеша. Сброс виден остальным
+    процессам, только если кеш общий (CACHES); с LocMemCache версия
+    живет LOCAL_VERSION_TIMEOUT секунд, и другие процессы получают
+    изменения с такой задержкой.
+    """
+
+    def __init__(self, maxsize=16):
+        self._local = LRUCache(maxsize)
+
+    def version_timeout(self):
+        return None if cache_is_shared() else LOCAL_VERSION_TIMEOUT
+
+    def version(self, name):
+        key = VERSION_KEY.format(name=name)
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, uuid.uuid4().hex, timeout=self.version_timeout())
+            version = cache.get(key)
+        return version
+
+    def invalidate(self, name):
+        cache.set(VERSION_KEY.format(name=name), uuid.uuid4().hex,
+                  timeout=self.version_timeout())
+        self._local.clear()
+
+    def get(self, name, build):
+        version = self.version(name)
+        entry = self._local.get((name, version))
+        if entry is None:
+            key = PAYLOAD_KEY.format(name=name, version=version)
+            entry = cache.get(key)
+            if entry is None:
+                content = build()
+                entry = (content, make_etag(content))
+                cache.set(key, entry, timeout=PAYLOAD_TIMEOUT)
+            self._local.set((name, version), entry)
+        return entry
+
+
+catalog_cache = CatalogCache()
+
+
+class MembershipCache:
+    """Множества id избранного, корзины и подписок пользователя.
+
+    Позволяют отклонить повторное добавление или удаление без запроса
+    к базе. Множество загружается целиком при первой проверке и
+    удаляется из кеша сигналами при любом изменении. Локального кеша
+    нет: устаревшее множество отклоняло бы допустимые запросы. По той же
+    причине get() возвращает None, если кеш не общий (LocMemCache):
+    сброс из другого процесса до него не дойдет, и проверять нужно
+    по базе.
+    """
+    timeout = 10 * 60
+
+    def get(self, name, user_id, load):
+        if not cache_is_shared():
+            return None
+        key = MEMBERSHIP_KEY.format(name=name, user_id=user_id)
+        members = cache.get(key)
+        if members is None:
+            members = frozenset(load())
+            cache.set(key, members, self.timeout)
+        return members
+
+    def invalidate(self, name, user_id):
+        key = MEMBERSHIP_KEY.format(name=name, user_id=user_id)
+        cache.delete(key)
+        # До конца транзакции параллельный запрос может снова положить
+        # в кеш старое множество.
+        transaction.on_commit(lambda: cache.delete(key))
+
+
+membership_cache = MembershipCache()
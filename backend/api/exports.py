@@ -0,0 +1,131 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import ExportJob
+from .profiling import timer
+from .renderers import render_shopping_list_pdf
+from .shopping_list import get_shopping_list
+
+logger = logging.getLogger(__name__)
+
+# Увеличивается при изменении оформления PDF, чтобы не отдавать
+# из кэша файлы, собранные по-старому.
+EXPORT_VERSION = 1
+
+# Каждый поток ждет результата одного процесса, поэтому потоков столько
+# же, сколько процессов.
+dispatcher = ThreadPoolExecutor(max_workers=settings.EXPORT_PROCESSES,
+                                thread_name_prefix='exports')
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    # Процессы запускаются при первой выгрузке, а не при импорте. Метод
+    # spawn вместо fork: в процессе сервера уже работают пулы потоков.
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=settings.EXPORT_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn'))
+        return _process_pool
+
+
+def export_name(ingredients):
+    content = json.dumps(
+        [EXPORT_VERSION,
+         [(ingredient['name'], ingredient['measurement_unit'],
+           ingredient['total_amount']) for ingredient in ingredients]],
+        ensure_ascii=False)
+    digest = hashlib.sha256(content.encode()).hexdigest()
+    return f'exports/{digest}.pdf'
+
+
+def store_export(name, content):
+    # Одинаковые корзины двух пользователей могут собираться одновременно,
+    # второй файл с тем же содержимым не нужен.
+    saved = default_storage.save(name, ContentFile(content))
+    if saved != name:
+        default_storage.delete(saved)
+    return name
+
+
+def cached_export(ingredients):
+    """Имя файла PDF для списка покупок, собирает его при промахе кэша.
+
+    PDF собирается в пуле процессов: сборка занимает процессор и под GIL
+    задерживала бы остальные запросы процесса сервера.
+    """
+    name = export_name(ingredients)
+    if default_storage.exists(name):
+        return name
+    with timer('render'):
+        content = render_in_process(ingredients)
+    return store_export(name, content)
+
+
+def render_in_process(ingredients):
+    global _process_pool
+    pool = get_process_pool()
+    try:
+        return pool.submit(render_shopping_list_pdf, ingredients).result()
+    except BrokenProcessPool:
+        # Упавший процесс (например, из-за нехватки памяти) ломает весь
+        # пул, следующие выгрузки запустят новый.
+        with _process_pool_lock:
+            if _process_pool is pool:
+                _process_pool = None
+        raise
+
+
+def run_job(job_id):
+    try:
+        claimed = ExportJob.objects.filter(
+            pk=job_id, status=ExportJob.PENDING
+        ).update(status=ExportJob.RUNNING)
+        if not claimed:
+            return
+        job = ExportJob.objects.get(pk=job_id)
+        # Корзина читается заново: она могла измениться, пока задача
+        # ждала в очереди.
+        ingredients = list(get_shopping_list(job.user_id))
+        name = cached_export(ingredients)
+        ExportJob.objects.filter(pk=job_id).update(
+            status=ExportJob.DONE, file=name, finished_at=timezone.now())
+    except Exception:
+        logger.exception('Не удалось выгрузить список покупок %s', job_id)
+        ExportJob.objects.filter(pk=job_id).update(
+            status=ExportJob.FAILED, finished_at=timezone.now())
+    finally:
+        # Выгрузки редкие, держать соединения в потоках пула незачем.
+        connections.close_all()
+
+
+def schedule_job(job_id):
+    transaction.on_commit(lambda: dispatcher.submit(run_job, job_id))
+
+
+def create_job(user):
+    """Создает выгрузку; неизмененная корзина отдается из кэша сразу."""
+    ingredients = list(get_shopping_list(user))
+    name = export_name(ingredients)
+    if default_storage.exists(name):
+        return ExportJob.objects.create(user=user, status=ExportJob.DONE,
+                                        file=name,
+                                        finished_at=timezone.now())
+    job = ExportJob.objects.create(user=user)
+    schedule_job(job.pk)
+    return job
@@ -0,0 +1,56 @@
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import F, OuterRef, Subquery, Window
+from django.db.models.functions import RowNumber
+
+from .models import Recipe
+
+DEFAULT_RECIPES_LIMIT = 3
+RECIPE_FIELDS = ('id', 'name', 'image', 'thumbnails_source', 'cooking_time',
+                 'author_id')
+
+
+def get_recipes_limit(request):
+    if request is None:
+        return DEFAULT_RECIPES_LIMIT
+    try:
+        return max(int(request.query_params.get(
+            'recipes_limit', DEFAULT_RECIPES_LIMIT)), 0)
+    except ValueError:
+        return DEFAULT_RECIPES_LIMIT
+
+
+def ranked_recipes(author_ids, limit):
+    ranked = Recipe.objects.filter(author_id__in=author_ids).order_by(
+    ).annotate(recipe_rank=Window(
+        expression=RowNumber(),
+        partition_by=[F('author_id')],
+        order_by=F('id').desc())
+    ).values(*RECIPE_FIELDS, 'recipe_rank')
+    sql, params = ranked.query.sql_with_params()
+    return Recipe.objects.raw(
+        f'SELECT * FROM ({sql}) ranked WHERE recipe_rank <= %s '
+        f'ORDER BY author_id, id DESC', (*params, limit))
+
+
+def correlated_recipes(author_ids, limit):
+    latest = Recipe.objects.filter(
+        author_id=OuterRef('author_id')).order_by('-id').values('pk')[:limit]
+    return Recipe.objects.filter(
+        author_id__in=author_ids, pk__in=Subquery(latest)
+    ).order_by('author_id', '-id').only(*RECIPE_FIELDS)
+
+
+def latest_recipes(author_ids, limit):
+    """Последние limit рецептов каждого автора одним запросом."""
+    recipes = defaultdict(list)
+    if not author_ids or not limit:
+        return recipes
+    if connection.features.supports_over_clause:
+        queryset = ranked_recipes(author_ids, limit)
+    else:
+        queryset = correlated_recipes(author_ids, limit)
+    for recipe in queryset:
+        recipes[recipe.author_id].append(recipe)
+    return recipes
@@ -0,0 +1,15 @@
+from django.core.files.uploadedfile import UploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework import serializers
+
+
+class RecipeImageField(Base64ImageField):
+    """Принимает картинку, уже декодированную RecipeJSONParser.
+
+    Строки base64 из других парсеров обрабатываются как раньше.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            return serializers.ImageField.to_internal_value(self, data)
+        return super().to_internal_value(data)
@@ -1,38 +1,90 @@
+from django.db.models import Exists, F, OuterRef
 from django_filters import rest_framework as filters
 
-from .models import Ingredient, Recipe, Tag
+from .models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from .search import search_ingredients, search_recipes
+
+POPULAR_ORDERING = ('-popularity_score', '-id')
 
 
 class IngredientFilter(filters.FilterSet):
-    name = filters.CharFilter(field_name="name", lookup_expr='icontains')
+    # Подсказки при вводе ограничены и без параметра limit.
+    default_limit = 20
+    max_limit = 100
+
+    name = filters.CharFilter(method='search_name')
+    limit = filters.NumberFilter(min_value=1, method='limit_results')
 
     class Meta:
         model = Ingredient
-        fields = ('name', )
+        fields = ('name', 'limit')
+
+    def get_limit(self):
+        limit = self.form.cleaned_data.get('limit')
+        if not limit:
+            return self.default_limit
+        return min(int(limit), self.max_limit)
+
+    def search_name(self, queryset, name, value):
+        return search_ingredients(queryset, value, self.get_limit())
+
+    def limit_results(self, queryset, name, value):
+        return queryset[:self.get_limit()]
 
 
 class RecipeFilter(filters.FilterSet):
     tags = filters.ModelMultipleChoiceFilter(
         to_field_name='slug',
         queryset=Tag.objects.all(),
-        field_name='tags__slug')
+        field_name='tags__slug',
+        method='get_tags')
     is_favorited = filters.BooleanFilter(
         method='get_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart')
+    search = filters.CharFilter(method='get_search')
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'popular'),),
+        method='get_ordering')
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+                  'search', 'ordering')
 
-    def get_is_favorited(self, queryset, name, value):
+    def filter_user_relation(self, queryset, model):
         user = self.request.user
+        if user.is_anonymous:
+            return queryset.none()
+        return queryset.filter(Exists(model.objects.filter(
+            user=user, recipe=OuterRef('pk'))))
+
+    def get_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'), tag__in=value)))
+
+    def get_is_favorited(self, queryset, name, value):
         if value:
-            return queryset.filter(is_favorited__user=user)
+            return self.filter_user_relation(queryset, Favorite)
         return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
-        user = self.request.user
         if value:
-            return queryset.filter(in_shopping_cart__user=user)
+            return self.filter_user_relation(queryset, ShoppingCart)
+        return queryset
+
+    def get_search(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+        return search_recipes(queryset, value)
+
+    def get_ordering(self, queryset, name, value):
+        if value == 'popular':
+            # Строка популярности создается вместе с рецептом, поэтому
+            # соединение может быть внутренним и идти по индексу score.
+            return queryset.filter(popularity__isnull=False).annotate(
+                popularity_score=F('popularity__score')
+            ).order_by(*POPULAR_ORDERING)
         return queryset
@@ -0,0 +1,78 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZES = {
+    'card': (480, 480),
+    'detail': (1200, 1200),
+}
+THUMBNAIL_FORMATS = {
+    'webp': 'WEBP',
+    'jpeg': 'JPEG',
+}
+
+executor = ThreadPoolExecutor(max_workers=settings.RECIPE_IMAGE_WORKERS,
+                              thread_name_prefix='thumbnails')
+
+
+def thumbnail_name(name, size, extension):
+    directory, filename = os.path.split(os.path.splitext(name)[0])
+    return f'{directory}/thumbnails/{filename}_{size}.{extension}'
+
+
+def thumbnails_ready(name):
+    # Миниатюры создаются по порядку, последняя появляется последней.
+    return default_storage.exists(thumbnail_name(
+        name, list(THUMBNAIL_SIZES)[-1], list(THUMBNAIL_FORMATS)[-1]))
+
+
+def generate_thumbnails(name):
+    # Рецепт пересохраняется при каждом изменении, а картинка - редко:
+    # не декодируем оригинал, если миниатюры уже есть.
+    if not thumbnails_ready(name):
+        save_thumbnails(name)
+    # Ссылки на миниатюры появляются в ответе, ETag должен измениться.
+    Recipe.objects.filter(image=name).exclude(thumbnails_source=name).update(
+        thumbnails_source=name, updated_at=timezone.now())
+
+
+def save_thumbnails(name):
+    with default_storage.open(name) as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image = image.convert('RGB')
+    for size, dimensions in THUMBNAIL_SIZES.items():
+        thumbnail = image.copy()
+        thumbnail.thumbnail(dimensions)
+        for extension, image_format in THUMBNAIL_FORMATS.items():
+            target = thumbnail_name(name, size, extension)
+            if default_storage.exists(target):
+                continue
+            buf = BytesIO()
+            thumbnail.save(buf, image_format, quality=80)
+            default_storage.save(target, ContentFile(buf.getvalue()))
+
+
+def safe_generate_thumbnails(name):
+    try:
+        generate_thumbnails(name)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры для %s', name)
+    finally:
+        connections.close_all()
+
+
+def schedule_thumbnails(name):
+    transaction.on_commit(
+        lambda: executor.submit(safe_generate_thumbnails, name))
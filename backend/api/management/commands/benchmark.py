@@ -0,0 +1,364 @@
+import base64
+import json
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment,
+                               teardown_test_environment)
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api import images
+from api.cache import catalog_cache
+from api.models import (Favorite, Follow, Ingredient, IngredientAmount, Recipe,
+                        ShoppingCart, Tag, User)
+
+# Запросы, которые проверяются по умолчанию: (имя, метод, адрес,
+# от имени пользователя или анонимно). Поисковые запросы берутся из
+# созданных данных, чтобы находить их при любых --recipes и --catalog.
+ENDPOINTS = (
+    ('recipes-list', 'get', '/api/recipes/', True),
+    ('recipes-list-anonymous', 'get', '/api/recipes/', False),
+    ('recipes-list-cursor', 'get', '/api/recipes/?cursor=', True),
+    ('recipes-favorited', 'get', '/api/recipes/?is_favorited=1', True),
+    ('recipes-in-cart', 'get', '/api/recipes/?is_in_shopping_cart=1',
+     True),
+    ('recipes-tags', 'get', '/api/recipes/?tags=tag-0&tags=tag-1', True),
+    ('recipes-popular', 'get', '/api/recipes/?ordering=popular', True),
+    ('recipes-popular-cursor', 'get',
+     '/api/recipes/?ordering=popular&cursor=', True),
+    ('recipes-search', 'get', '/api/recipes/?search={recipe_name}', True),
+    ('recipes-detail', 'get', '/api/recipes/{recipe}/', True),
+    ('recipes-create', 'post', '/api/recipes/', True),
+    ('subscriptions', 'get', '/api/users/subscriptions/', True),
+    ('users-list', 'get', '/api/users/', True),
+    ('users-me', 'get', '/api/users/me/', True),
+    ('tags-list', 'get', '/api/tags/', False),
+    ('ingredients-list', 'get', '/api/ingredients/', False),
+    ('ingredients-search', 'get', '/api/ingredients/?name={ingredient_name}',
+     False),
+    ('shopping-cart-pdf', 'get',
+     '/api/recipes/download_shopping_cart/?format=pdf', True),
+    ('shopping-cart-csv', 'get',
+     '/api/recipes/download_shopping_cart/?format=csv', True),
+)
+
+# Бюджеты по умолчанию. Число запросов не должно зависеть от объема
+# данных, поэтому эти бюджеты проверяются всегда; бюджеты по времени
+# (p50_ms, p95_ms) и памяти (memory_mb) можно задать через --budgets.
+BUDGETS = {
+    'recipes-list': {'queries': 5},
+    'recipes-list-anonymous': {'queries': 5},
+    'recipes-list-cursor': {'queries': 4},
+    'recipes-favorited': {'queries': 5},
+    'recipes-in-cart': {'queries': 5},
+    'recipes-tags': {'queries': 6},
+    'recipes-popular': {'queries': 5},
+    'recipes-popular-cursor': {'queries': 4},
+    'recipes-search': {'queries': 5},
+    'recipes-detail': {'queries': 4},
+    'recipes-create': {'queries': 24},
+    'subscriptions': {'queries': 3},
+    'users-list': {'queries': 3},
+    'users-me': {'queries': 0},
+    'tags-list': {'queries': 0},
+    'ingredients-list': {'queries': 0},
+    'ingredients-search': {'queries': 1},
+    'shopping-cart-pdf': {'queries': 1},
+    'shopping-cart-csv': {'queries': 1},
+}
+
+
+def make_image():
+    buffer = BytesIO()
+    Image.new('RGB', (64, 64), (200, 120, 40)).save(buffer, 'PNG')
+    return ('data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = max(0, round(len(values) * percent / 100) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def add_data_arguments(parser):
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--recipes', type=int, default=500)
+    parser.add_argument('--ingredients', type=int, default=10,
+                        help='Ингредиентов в рецепте')
+    parser.add_argument('--catalog', type=int, default=2000,
+                        help='Ингредиентов в справочнике')
+    parser.add_argument('--tags', type=int, default=5)
+    parser.add_argument('--favorites', type=int, default=20)
+    parser.add_argument('--follows', type=int, default=10)
+    parser.add_argument('--cart', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def check_data_options(options):
+    if options['tags'] < 2:
+        raise CommandError('Нужно хотя бы два тега')
+    if options['ingredients'] > options['catalog']:
+        raise CommandError(
+            'Ингредиентов в рецепте больше, чем в справочнике')
+
+
+class DeferredExecutor:
+    """Копит фоновые задачи и выполняет их в текущем потоке по запросу.
+
+    В пуле потоков миниатюры новых рецептов писали бы в базу во время
+    замеров: SQLite отвечал бы им "database table is locked", а время
+    и число запросов замера зависели бы от фоновой работы.
+    """
+
+    def __init__(self):
+        self.tasks = []
+
+    def submit(self, function, *args, **kwargs):
+        self.tasks.append((function, args, kwargs))
+
+    def drain(self):
+        while self.tasks:
+            function, args, kwargs = self.tasks.pop(0)
+            function(*args, **kwargs)
+
+
+@contextmanager
+def test_environment():
+    """Временные тестовая база и MEDIA_ROOT на время замеров.
+
+    Возвращает DeferredExecutor, через который идут фоновые задачи.
+    """
+    old_name = connection.settings_dict['NAME']
+    media_root = tempfile.mkdtemp(prefix='foodgram-benchmark-')
+    setup_test_environment()
+    try:
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        background = DeferredExecutor()
+        with override_settings(MEDIA_ROOT=media_root), \
+                mock.patch.object(images, 'executor', background):
+            yield background
+            # Миниатюры новых рецептов должны дописаться
+            # во временный каталог, пока подменен MEDIA_ROOT.
+            background.drain()
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+class DataGenerator:
+    """Заполняет базу синтетическими данными."""
+
+    def __init__(self, options):
+        self.options = options
+        self.random = random.Random(options['seed'])
+
+    @staticmethod
+    def bulk_create(model, objects):
+        # SQLite не возвращает первичные ключи из bulk_create, поэтому
+        # созданные объекты перечитываются из пустой тестовой базы.
+        model.objects.bulk_create(objects, batch_size=1000)
+        return list(model.objects.order_by('pk'))
+
+    def sample(self, population, size):
+        return self.random.sample(population, min(size, len(population)))
+
+    def generate(self):
+        options = self.options
+        password = make_password(None)
+        users = self.bulk_create(User, (
+            User(username=f'user{i}', email=f'user{i}@example.com',
+                 first_name='Имя', last_name='Фамилия', password=password)
+            for i in range(options['users'])))
+        tags = self.bulk_create(Tag, (
+            Tag(name=f'Тег {i}', color=f'#{i:06x}', slug=f'tag-{i}')
+            for i in range(options['tags'])))
+        ingredients = self.bulk_create(Ingredient, (
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г',
+                       canonical_unit='г')
+            for i in range(options['catalog'])))
+        recipes = self.bulk_create(Recipe, (
+            Recipe(author=self.random.choice(users), name=f'Рецепт {i}',
+                   image='recipes/images/benchmark.png', text='Описание',
+                   cooking_time=self.random.randint(1, 120))
+            for i in range(options['recipes'])))
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag=tag)
+            for recipe in recipes
+            for tag in self.sample(tags, 2))
+        IngredientAmount.objects.bulk_create(
+            (IngredientAmount(recipe=recipe, ingredient=ingredient,
+                              amount=self.random.randint(1, 500))
+             for recipe in recipes
+             for ingredient in self.sample(
+                 ingredients, options['ingredients'])),
+            batch_size=1000)
+        Favorite.objects.bulk_create(
+            (Favorite(user=user, recipe=recipe)
+             for user in users
+             for recipe in self.sample(recipes, options['favorites'])),
+            batch_size=1000)
+        ShoppingCart.objects.bulk_create(
+            (ShoppingCart(user=user, recipe=recipe)
+             for user in users
+             for recipe in self.sample(recipes, options['cart'])),
+            batch_size=1000)
+        Follow.objects.bulk_create(
+            (Follow(user=user, author=author)
+             for user in users
+             for author in self.sample(
+                 [author for author in users if author != user],
+                 options['follows'])),
+            batch_size=1000)
+        call_command('recount', stdout=StringIO())
+        call_command('recount_shopping_cart', stdout=StringIO())
+        call_command('refresh_popularity', full=True, stdout=StringIO())
+        call_command('rebuild_search', stdout=StringIO())
+        catalog_cache.invalidate('tags')
+        catalog_cache.invalidate('ingredients')
+        return users[0], recipes[0], ingredients, tags
+
+
+class Command(BaseCommand):
+    help = ('Измеряет число SQL-запросов, время ответа и пиковую память '
+            'эндпоинтов API на синтетических данных')
+
+    def add_arguments(self, parser):
+        add_data_arguments(parser)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--endpoint', action='append',
+                            help='Измерять только указанные эндпоинты')
+        parser.add_argument('--budgets',
+                            help='JSON-файл с бюджетами эндпоинтов')
+
+    def handle(self, *args, **options):
+        check_data_options(options)
+        budgets = self.load_budgets(options['budgets'])
+        endpoints = [
+            endpoint for endpoint in ENDPOINTS
+            if not options['endpoint'] or endpoint[0] in options['endpoint']
+        ]
+        with test_environment() as background:
+            results = self.run_benchmark(endpoints, options, background)
+        self.report(results)
+        failures = self.check_budgets(results, budgets)
+        if failures:
+            raise CommandError('Превышены бюджеты:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('Все бюджеты соблюдены'))
+
+    def load_budgets(self, path):
+        budgets = {name: dict(budget) for name, budget in BUDGETS.items()}
+        if path:
+            with open(path, encoding='utf8') as file:
+                for name, budget in json.load(file).items():
+                    budgets.setdefault(name, {}).update(budget)
+        return budgets
+
+    def run_benchmark(self, endpoints, options, background):
+        start = time.monotonic()
+        user, recipe, ingredients, tags = DataGenerator(options).generate()
+        self.stdout.write(
+            f'Данные созданы за {time.monotonic() - start:.1f} с')
+        token = Token.objects.create(user=user)
+        clients = {False: APIClient(), True: APIClient()}
+        clients[True].credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        payload = {
+            'name': 'Новый рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': make_image(),
+            'tags': [tag.id for tag in tags[:2]],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 100}
+                for ingredient in ingredients[:options['ingredients']]
+            ],
+        }
+        results = {}
+        for name, method, url, authorized in endpoints:
+            url = url.format(recipe=recipe.id, recipe_name=recipe.name,
+                             ingredient_name=ingredients[0].name)
+            client = clients[authorized]
+
+            def call():
+                if method == 'post':
+                    response = client.post(url, payload, format='json')
+                else:
+                    response = getattr(client, method)(url)
+                if response.streaming:
+                    for _ in response.streaming_content:
+                        pass
+                if response.status_code >= 400:
+                    raise CommandError(
+                        f'{name}: {method.upper()} {url} вернул '
+                        f'{response.status_code}')
+                return response
+
+            results[name] = self.measure(call, options['repeat'],
+                                         background)
+        return results
+
+    def measure(self, call, repeat, background):
+        # Фоновые задачи выполняются между вызовами, вне замеров.
+        call()
+        background.drain()
+        timings = []
+        queries = 0
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                call()
+                timings.append((time.perf_counter() - start) * 1000)
+            queries = max(queries, len(context))
+            background.drain()
+        tracemalloc.start()
+        try:
+            call()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        background.drain()
+        return {
+            'queries': queries,
+            'p50_ms': statistics.median(timings),
+            'p95_ms': percentile(timings, 95),
+            'memory_mb': peak / 1024 / 1024,
+        }
+
+    def report(self, results):
+        width = max(map(len, results), default=0)
+        self.stdout.write(
+            f'{"эндпоинт":<{width}}  запросы   p50, мс   p95, мс  '
+            f'память, МБ')
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<{width}}  {result["queries"]:>7}  '
+                f'{result["p50_ms"]:>8.1f}  {result["p95_ms"]:>8.1f}  '
+                f'{result["memory_mb"]:>10.2f}')
+
+    def check_budgets(self, results, budgets):
+        failures = []
+        for name, result in results.items():
+            for metric, limit in budgets.get(name, {}).items():
+                if metric not in result:
+                    raise CommandError(
+                        f'{name}: неизвестная метрика {metric}')
+                if result[metric] > limit:
+                    failures.append(
+                        f'{name}: {metric} {result[metric]:g} > {limit:g}')
+        return failures
@@ -0,0 +1,51 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.exports import run_job
+from api.models import ExportJob
+
+EXPORTS_DIR = 'exports'
+
+
+class Command(BaseCommand):
+    help = ('Удаляет старые выгрузки списков покупок и файлы, на которые '
+            'не ссылаются задачи')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.EXPORT_MAX_AGE_DAYS,
+            help='Сколько дней хранить задачи и файлы')
+        parser.add_argument(
+            '--requeue', action='store_true',
+            help='Выполнить задачи, оставшиеся в очереди после перезапуска')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        deleted, _ = ExportJob.objects.filter(created__lt=cutoff).delete()
+        self.stdout.write(f'Удалено задач: {deleted}')
+
+        if options['requeue']:
+            ExportJob.objects.filter(status=ExportJob.RUNNING).update(
+                status=ExportJob.PENDING)
+            pending = list(ExportJob.objects.filter(
+                status=ExportJob.PENDING).values_list('pk', flat=True))
+            for job_id in pending:
+                run_job(job_id)
+            self.stdout.write(f'Выполнено задач: {len(pending)}')
+
+        if not default_storage.exists(EXPORTS_DIR):
+            return
+        used = set(ExportJob.objects.exclude(file='').values_list(
+            'file', flat=True))
+        removed = 0
+        for filename in default_storage.listdir(EXPORTS_DIR)[1]:
+            name = f'{EXPORTS_DIR}/{filename}'
+            if (name not in used
+                    and default_storage.get_modified_time(name) < cutoff):
+                default_storage.delete(name)
+                removed += 1
+        self.stdout.write(f'Удалено файлов: {removed}')
@@ -1,15 +1,96 @@
 import csv
+import json
+import os
+import time
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
+from api.cache import catalog_cache
 from api.models import Ingredient
+from api.utils import batched
+
+DEFAULT_PATH = os.path.join(settings.BASE_DIR, 'ingredients.csv')
+CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    for line in csv.reader(file):
+        if line:
+            yield line[0], line[1]
+
+
+def read_json(file):
+    decoder = json.JSONDecoder()
+    buffer = file.read(CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидается JSON-массив ингредиентов')
+    buffer = buffer[1:]
+    eof = False
+    while True:
+        buffer = buffer.lstrip(' \t\r\n,')
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if eof:
+                raise CommandError('Некорректный JSON')
+            chunk = file.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+        yield item['name'], item['measurement_unit']
+        buffer = buffer[end:]
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+}
 
 
 class Command(BaseCommand):
+    help = 'Загружает ингредиенты из CSV или JSON файла'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_PATH)
+        parser.add_argument('--format', choices=READERS.keys())
+        parser.add_argument('--batch-size', type=int, default=1000)
+
     def handle(self, *args, **options):
-        with open('ingredients.csv', 'r', encoding='utf8') as file:
-            reader = csv.reader(file)
-            print(reader)
-            for line in reader:
-                Ingredient.objects.create(name=line[0],
-                                          measurement_unit=line[1])
+        path = options['path']
+        file_format = (options['format']
+                       or os.path.splitext(path)[1].lstrip('.').lower())
+        if file_format not in READERS:
+            raise CommandError(f'Неизвестный формат файла: {path}')
+        batch_size = options['batch_size']
+        start = time.monotonic()
+        read = created = 0
+        with open(path, 'r', encoding='utf8') as file, transaction.atomic():
+            existing = set(Ingredient.objects.values_list(
+                'name', 'measurement_unit'))
+            rows = READERS[file_format](file)
+            for batch in batched(rows, batch_size):
+                read += len(batch)
+                ingredients = []
+                for name, measurement_unit in batch:
+                    key = (name.strip(), measurement_unit.strip())
+                    if key not in existing:
+                        existing.add(key)
+                        ingredient = Ingredient(
+                            name=key[0], measurement_unit=key[1])
+                        ingredient.normalize_unit()
+                        ingredients.append(ingredient)
+                Ingredient.objects.bulk_create(ingredients,
+                                               ignore_conflicts=True)
+                created += len(ingredients)
+            # bulk_create не отправляет post_save, справочник
+            # сбрасывается вручную.
+            transaction.on_commit(
+                lambda: catalog_cache.invalidate('ingredients'))
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано {read}, добавлено {created} за {elapsed:.2f} с '
+            f'({read / elapsed if elapsed else read:.0f} строк/с)'))
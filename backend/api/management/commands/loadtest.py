@@ -0,0 +1,220 @@
+import asyncio
+import statistics
+import sys
+import threading
+import time
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from rest_framework.authtoken.models import Token
+
+from .benchmark import (DataGenerator, add_data_arguments, check_data_options,
+                        percentile, test_environment)
+
+# Эндпоинты нагрузочного теста: (имя, адрес, от имени пользователя).
+LOAD_ENDPOINTS = (
+    ('recipes-list', '/api/recipes/', True),
+    ('recipes-detail', '/api/recipes/{recipe}/', True),
+    ('tags-list', '/api/tags/', False),
+    ('ingredients-list', '/api/ingredients/', False),
+    ('shopping-cart-pdf',
+     '/api/recipes/download_shopping_cart/?format=pdf', True),
+)
+
+
+def wsgi_environ(url, token):
+    parts = urlsplit(url)
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': parts.path,
+        'QUERY_STRING': parts.query,
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'testserver',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if token:
+        environ['HTTP_AUTHORIZATION'] = f'Token {token}'
+    return environ
+
+
+def asgi_scope(url, token):
+    parts = urlsplit(url)
+    headers = [(b'host', b'testserver')]
+    if token:
+        headers.append((b'authorization', f'Token {token}'.encode()))
+    return {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': parts.path,
+        'raw_path': parts.path.encode(),
+        'query_string': parts.query.encode(),
+        'root_path': '',
+        'headers': headers,
+        'server': ('testserver', 80),
+        'client': ('127.0.0.1', 0),
+    }
+
+
+class LoadResult:
+
+    def __init__(self):
+        self.timings = []
+        self.errors = 0
+        self.elapsed = 0.0
+
+    def add(self, start, ok):
+        self.timings.append((time.perf_counter() - start) * 1000)
+        if not ok:
+            self.errors += 1
+
+    def as_dict(self):
+        return {
+            'rps': len(self.timings) / self.elapsed if self.elapsed else 0,
+            'p50_ms': statistics.median(self.timings),
+            'p95_ms': percentile(self.timings, 95),
+            'errors': self.errors,
+        }
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность и задержки WSGI и ASGI '
+            'при множестве одновременных медленных клиентов')
+
+    def add_arguments(self, parser):
+        add_data_arguments(parser)
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help='Одновременных клиентов')
+        parser.add_argument('--requests', type=int, default=500,
+                            help='Запросов на эндпоинт')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Синхронных воркеров в режиме WSGI')
+        parser.add_argument('--client-delay', type=float, default=20,
+                            help='Время получения ответа клиентом, мс')
+        parser.add_argument('--endpoint', action='append',
+                            help='Нагружать только указанные эндпоинты')
+
+    def handle(self, *args, **options):
+        check_data_options(options)
+        endpoints = [
+            endpoint for endpoint in LOAD_ENDPOINTS
+            if not options['endpoint'] or endpoint[0] in options['endpoint']
+        ]
+        with test_environment():
+            results = self.run_load(endpoints, options)
+        self.report(results)
+
+    def run_load(self, endpoints, options):
+        from foodgram.asgi import application as asgi_application
+        from foodgram.wsgi import application as wsgi_application
+
+        user, recipe, _, _ = DataGenerator(options).generate()
+        token = Token.objects.create(user=user).key
+        # Соединения потоков сервера закрываются после каждого запроса,
+        # иначе тестовую базу не удастся удалить.
+        for connection in connections.all():
+            connection.settings_dict['CONN_MAX_AGE'] = 0
+        results = {}
+        for name, url, authorized in endpoints:
+            url = url.format(recipe=recipe.id)
+            request_token = token if authorized else None
+            results[name, 'wsgi'] = self.run_wsgi(
+                wsgi_application, url, request_token, options)
+            results[name, 'asgi'] = asyncio.run(self.run_asgi(
+                asgi_application, url, request_token, options))
+        return results
+
+    def run_wsgi(self, application, url, token, options):
+        # Воркер занят, пока клиент не дочитает ответ, как у gunicorn
+        # с синхронными воркерами.
+        workers = threading.BoundedSemaphore(options['workers'])
+        delay = options['client_delay'] / 1000
+        remaining = iter(range(options['requests']))
+        lock = threading.Lock()
+        result = LoadResult()
+
+        def client():
+            try:
+                while True:
+                    with lock:
+                        if next(remaining, None) is None:
+                            return
+                    start = time.perf_counter()
+                    statuses = []
+                    with workers:
+                        body = application(
+                            wsgi_environ(url, token),
+                            lambda status, headers, exc_info=None:
+                                statuses.append(status))
+                        try:
+                            for chunk in body:
+                                if chunk:
+                                    time.sleep(delay)
+                        finally:
+                            body.close()
+                    result.add(start, statuses[0].startswith('200'))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=client)
+                   for _ in range(options['concurrency'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        result.elapsed = time.perf_counter() - start
+        return result.as_dict()
+
+    async def run_asgi(self, application, url, token, options):
+        delay = options['client_delay'] / 1000
+        remaining = options['requests']
+        result = LoadResult()
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def client():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                statuses = []
+
+                async def send(message):
+                    if message['type'] == 'http.response.start':
+                        statuses.append(message['status'])
+                    elif message.get('body'):
+                        await asyncio.sleep(delay)
+
+                start = time.perf_counter()
+                await application(asgi_scope(url, token), receive, send)
+                result.add(start, statuses[0] == 200)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client()
+                               for _ in range(options['concurrency'])))
+        result.elapsed = time.perf_counter() - start
+        return result.as_dict()
+
+    def report(self, results):
+        width = max((len(name) for name, _ in results), default=0)
+        self.stdout.write(
+            f'{"эндпоинт":<{width}}  режим  запросов/с   p50, мс   '
+            f'p95, мс  ошибки')
+        for (name, mode), result in results.items():
+            self.stdout.write(
+                f'{name:<{width}}  {mode:<5}  {result["rps"]:>10.1f}  '
+                f'{result["p50_ms"]:>8.1f}  {result["p95_ms"]:>8.1f}  '
+                f'{result["errors"]:>6}')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from api.images import generate_thumbnails
+from api.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создает миниатюры для картинок рецептов, у которых их нет'
+
+    def handle(self, *args, **options):
+        created = 0
+        names = Recipe.objects.exclude(image='').exclude(
+            thumbnails_source=F('image')).values_list('image', flat=True)
+        for name in names.iterator():
+            # Готовые файлы не пересоздаются, отмечается только рецепт.
+            generate_thumbnails(name)
+            created += 1
+        self.stdout.write(f'Обработано картинок: {created}')
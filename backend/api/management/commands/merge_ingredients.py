@@ -0,0 +1,84 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, F, Min
+
+from api.cache import catalog_cache
+from api.models import Ingredient, IngredientAmount, Recipe
+
+
+def merge_rows(model, field, replacements, amount_field=None):
+    """Переносит строки связи с дубликатов на оставшийся ингредиент.
+
+    Если у рецепта уже есть строка с оставшимся ингредиентом, строка
+    дубликата удаляется, а ее количество прибавляется к оставшейся.
+    """
+    fields = ['pk', 'recipe_id', field]
+    if amount_field:
+        fields.append(amount_field)
+    rows = model.objects.filter(
+        **{f'{field}__in': replacements}).values_list(*fields)
+    existing = {
+        (recipe_id, ingredient_id): pk
+        for pk, recipe_id, ingredient_id in model.objects.filter(
+            **{f'{field}__in': set(replacements.values())}).values_list(
+                'pk', 'recipe_id', field)
+    }
+    moved = defaultdict(list)
+    merged = defaultdict(int)
+    removed = []
+    for pk, recipe_id, ingredient_id, *amount in rows:
+        key = (recipe_id, replacements[ingredient_id])
+        if key in existing:
+            removed.append(pk)
+            if amount:
+                merged[existing[key]] += amount[0]
+        else:
+            existing[key] = pk
+            moved[key[1]].append(pk)
+    for ingredient_id, pks in moved.items():
+        model.objects.filter(pk__in=pks).update(**{field: ingredient_id})
+    for pk, amount in merged.items():
+        model.objects.filter(pk=pk).update(
+            **{amount_field: F(amount_field) + amount})
+    model.objects.filter(pk__in=removed).delete()
+
+
+class Command(BaseCommand):
+    help = ('Объединяет ингредиенты с одинаковыми названием и единицей '
+            'измерения. Запускается перед migrate, которая добавляет '
+            'ограничение уникальности')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        # Схема может быть старше моделей, поэтому читаются только
+        # колонки, которые были в таблицах с самого начала.
+        groups = Ingredient.objects.order_by().values(
+            'name', 'measurement_unit').annotate(
+                keep=Min('pk'), total=Count('pk')).filter(total__gt=1)
+        replacements = {}
+        for group in groups:
+            for pk in Ingredient.objects.filter(
+                    name=group['name'],
+                    measurement_unit=group['measurement_unit']).exclude(
+                        pk=group['keep']).values_list('pk', flat=True):
+                replacements[pk] = group['keep']
+        self.stdout.write(f'Дубликатов ингредиентов: {len(replacements)}')
+        if not replacements or options['dry_run']:
+            return
+        merge_rows(IngredientAmount, 'ingredient_id', replacements,
+                   'amount')
+        merge_rows(Recipe.ingredients.through, 'ingredient_id',
+                   replacements)
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        with connection.cursor() as cursor:
+            # Без ORM: каскад затронул бы таблицы, которых еще нет.
+            cursor.execute(
+                f'DELETE FROM {table} WHERE id IN '
+                f'({", ".join(["%s"] * len(replacements))})',
+                list(replacements))
+        transaction.on_commit(lambda: catalog_cache.invalidate('ingredients'))
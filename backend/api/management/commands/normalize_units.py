@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.cache import catalog_cache
+from api.models import Ingredient
+from api.units import normalize_unit
+
+
+class Command(BaseCommand):
+    help = ('Заполняет каноническую единицу и множитель ингредиентов '
+            'по таблице пересчета единиц')
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        updated = 0
+        units = Ingredient.objects.order_by().values_list(
+            'measurement_unit', flat=True).distinct()
+        for unit in list(units):
+            canonical_unit, unit_factor = normalize_unit(unit)
+            updated += Ingredient.objects.filter(
+                measurement_unit=unit
+            ).exclude(
+                canonical_unit=canonical_unit, unit_factor=unit_factor
+            ).update(canonical_unit=canonical_unit, unit_factor=unit_factor)
+        if updated:
+            transaction.on_commit(
+                lambda: catalog_cache.invalidate('ingredients'))
+        self.stdout.write(f'Обновлено ингредиентов: {updated}')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Recipe, RecipeSearch
+from api.utils import batched
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает поисковые документы рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        rebuilt = 0
+        recipe_ids = Recipe.objects.order_by().values_list('pk', flat=True)
+        for batch in batched(recipe_ids.iterator(), options['batch_size']):
+            RecipeSearch.objects.rebuild_batch(batch)
+            rebuilt += len(batch)
+        self.stdout.write(f'Пересобрано документов: {rebuilt}')
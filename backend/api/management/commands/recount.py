@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from api.models import Favorite, Follow, Recipe, User
+
+
+def count_subquery(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field).annotate(total=Count('pk')).values('total')), 0)
+
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики избранного, рецептов и подписчиков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        for model, field, related_model, related_field in COUNTERS:
+            actual = count_subquery(related_model, related_field)
+            drifted = model.objects.annotate(actual=actual).exclude(
+                **{field: F('actual')}).values('pk')
+            if options['dry_run']:
+                fixed = drifted.count()
+            else:
+                fixed = model.objects.filter(pk__in=drifted).update(
+                    **{field: actual})
+            self.stdout.write(
+                f'{model._meta.verbose_name}.{field}: '
+                f'расхождений {fixed}')
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from api.models import IngredientAmount, ShoppingCart, ShoppingCartItem
+from api.utils import batched
+
+
+def expected_totals(user_ids):
+    totals = {}
+    for user_id, ingredient_id, amount in IngredientAmount.objects.filter(
+            recipe__in_shopping_cart__user__in=user_ids).order_by().values(
+                'recipe__in_shopping_cart__user', 'ingredient').annotate(
+                    total=Sum('amount')).values_list(
+                        'recipe__in_shopping_cart__user', 'ingredient',
+                        'total'):
+        totals[user_id, ingredient_id] = amount
+    return totals
+
+
+def actual_totals(user_ids):
+    return {(user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in
+            ShoppingCartItem.objects.filter(user__in=user_ids).values_list(
+                'user', 'ingredient', 'amount')}
+
+
+class Command(BaseCommand):
+    help = ('Сверяет суммы ингредиентов в списках покупок с полным '
+            'пересчетом по корзинам и исправляет расхождения')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        user_ids = sorted({
+            *ShoppingCart.objects.values_list('user', flat=True),
+            *ShoppingCartItem.objects.values_list('user', flat=True),
+        })
+        drifted = 0
+        for batch in batched(user_ids, options['batch_size']):
+            with transaction.atomic():
+                drifted += self.check_users(batch, options['dry_run'])
+        self.stdout.write(f'Списки покупок с расхождениями: {drifted}')
+
+    def check_users(self, user_ids, dry_run):
+        expected = expected_totals(user_ids)
+        actual = actual_totals(user_ids)
+        drifted = {key[0] for key in expected.keys() | actual.keys()
+                   if expected.get(key) != actual.get(key)}
+        if drifted and not dry_run:
+            ShoppingCartItem.objects.filter(user__in=drifted).delete()
+            ShoppingCartItem.objects.bulk_create(
+                ShoppingCartItem(user_id=user_id, ingredient_id=ingredient_id,
+                                 amount=amount)
+                for (user_id, ingredient_id), amount in expected.items()
+                if user_id in drifted)
+        return len(drifted)
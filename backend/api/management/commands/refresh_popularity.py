@@ -0,0 +1,92 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from api.models import Favorite, Recipe, RecipePopularity, ShoppingCart
+from api.utils import batched
+
+FAVORITE_WEIGHT = 2
+CART_WEIGHT = 1
+
+
+def count_recent(model, recipe_ids, cutoff):
+    return dict(model.objects.filter(
+        recipe_id__in=recipe_ids, created__gte=cutoff).order_by().values(
+            'recipe_id').annotate(total=Count('pk')).values_list(
+                'recipe_id', 'total'))
+
+
+def active_recipes(since, until=None):
+    # Рецепты, у которых есть добавления в избранное или корзину
+    # начиная с since (и раньше until, если он задан).
+    recipe_ids = set()
+    for model in (Favorite, ShoppingCart):
+        events = model.objects.filter(created__gte=since)
+        if until is not None:
+            events = events.filter(created__lt=until)
+        recipe_ids.update(events.values_list('recipe_id', flat=True))
+    return recipe_ids
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает популярность рецептов по добавлениям '
+            'в избранное и корзину за последние '
+            'POPULARITY_WINDOW_DAYS дней')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Пересчитать все рецепты')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        window = timedelta(days=settings.POPULARITY_WINDOW_DAYS)
+        cutoff = now - window
+        last_refresh = RecipePopularity.objects.aggregate(
+            last=Max('refreshed_at'))['last']
+        if options['full'] or last_refresh is None:
+            recipe_ids = Recipe.objects.order_by().values_list(
+                'pk', flat=True)
+        else:
+            # Изменившиеся с прошлого пересчета рецепты и те, у которых
+            # с тех пор часть добавлений вышла за пределы окна.
+            recipe_ids = active_recipes(last_refresh)
+            recipe_ids |= active_recipes(last_refresh - window, cutoff)
+            recipe_ids.update(RecipePopularity.objects.filter(
+                dirty=True).values_list('recipe_id', flat=True))
+        refreshed = 0
+        for batch in batched(recipe_ids, options['batch_size']):
+            self.refresh(batch, cutoff, now)
+            refreshed += len(batch)
+        self.stdout.write(f'Пересчитано рецептов: {refreshed}')
+
+    @transaction.atomic
+    def refresh(self, recipe_ids, cutoff, now):
+        # Флаг снимается до подсчета: добавление, случившееся во время
+        # пересчета, снова пометит рецепт.
+        RecipePopularity.objects.filter(
+            recipe_id__in=recipe_ids, dirty=True).update(dirty=False)
+        favorites = count_recent(Favorite, recipe_ids, cutoff)
+        cart_adds = count_recent(ShoppingCart, recipe_ids, cutoff)
+        rows = [
+            RecipePopularity(
+                recipe_id=recipe_id,
+                favorites=favorites.get(recipe_id, 0),
+                cart_adds=cart_adds.get(recipe_id, 0),
+                score=(FAVORITE_WEIGHT * favorites.get(recipe_id, 0)
+                       + CART_WEIGHT * cart_adds.get(recipe_id, 0)),
+                refreshed_at=now)
+            for recipe_id in recipe_ids
+        ]
+        existing = set(RecipePopularity.objects.filter(
+            recipe_id__in=recipe_ids).values_list('recipe_id', flat=True))
+        RecipePopularity.objects.bulk_update(
+            [row for row in rows if row.recipe_id in existing],
+            ('favorites', 'cart_adds', 'score', 'refreshed_at'))
+        RecipePopularity.objects.bulk_create(
+            [row for row in rows if row.recipe_id not in existing],
+            ignore_conflicts=True)
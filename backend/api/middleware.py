@@ -0,0 +1,77 @@
+import asyncio
+import json
+import logging
+import random
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .profiling import RequestProfile
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilingMiddleware:
+    """Считает запросы к базе и время обработки для части запросов.
+
+    Доля профилируемых запросов задается PROFILING_SAMPLE_RATE,
+    при нулевой доле middleware отключается. Итоги отдаются
+    в заголовке Server-Timing и пишутся в лог одной JSON-строкой.
+    У потоковых ответов заголовок описывает время до начала передачи,
+    а в лог попадают и запросы, выполненные во время нее.
+    Под ASGI middleware работает асинхронно и не занимает поток.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+        profile = RequestProfile()
+        with profile.activate():
+            response = self.get_response(request)
+        return self.finish(profile, request, response)
+
+    async def __acall__(self, request):
+        if random.random() >= self.sample_rate:
+            return await self.get_response(request)
+        profile = RequestProfile()
+        with profile.activate():
+            response = await self.get_response(request)
+        return self.finish(profile, request, response)
+
+    def finish(self, profile, request, response):
+        response['Server-Timing'] = profile.server_timing()
+        if response.streaming:
+            response.streaming_content = self.stream(
+                response.streaming_content, profile, request, response)
+        else:
+            self.log(profile, request, response)
+        return response
+
+    def stream(self, content, profile, request, response):
+        try:
+            with profile.activate():
+                yield from content
+        finally:
+            self.log(profile, request, response)
+
+    def log(self, profile, request, response):
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            **profile.as_dict(),
+        }
+        logger.info(json.dumps(record, ensure_ascii=False),
+                    extra={'profile': record})
@@ -1,5 +1,15 @@
+import uuid
+from collections import Counter, defaultdict
+
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import connections, models, transaction
+from django.db.models import BooleanField, Exists, OuterRef, Prefetch, Value
+from django.utils import timezone
+
+from users.models import CountersMixin
+
+from .units import normalize_unit
 
 User = get_user_model()
 
@@ -11,14 +21,36 @@ class Ingredient(models.Model):
     measurement_unit = models.CharField(
         max_length=255,
         verbose_name='Единица измерения')
+    canonical_unit = models.CharField(
+        max_length=255,
+        editable=False,
+        verbose_name='Единица в списке покупок')
+    unit_factor = models.PositiveIntegerField(
+        default=1,
+        editable=False,
+        verbose_name='Множитель единицы')
 
     class Meta:
         verbose_name = 'Ингрединт'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='unique_ingredient_measurement_unit'
+            )
+        ]
 
     def __str__(self) -> str:
         return self.name
 
+    def normalize_unit(self):
+        self.canonical_unit, self.unit_factor = normalize_unit(
+            self.measurement_unit)
+
+    def save(self, *args, **kwargs):
+        self.normalize_unit()
+        super().save(*args, **kwargs)
+
 
 class Tag(models.Model):
     name = models.CharField(
@@ -41,7 +73,31 @@ class Tag(models.Model):
         return self.name
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+
+    def with_related(self):
+        return self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch('ingredientamount_set',
+                     queryset=IngredientAmount.objects.select_related(
+                         'ingredient')))
+
+    def with_user_flags(self, user):
+        if user.is_anonymous:
+            false = Value(False, output_field=BooleanField())
+            return self.annotate(is_favorited_annotated=false,
+                                 is_in_shopping_cart_annotated=false,
+                                 is_subscribed_annotated=false)
+        return self.annotate(
+            is_favorited_annotated=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart_annotated=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_subscribed_annotated=Exists(Follow.objects.filter(
+                user=user, author=OuterRef('author'))))
+
+
+class Recipe(CountersMixin, models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -64,6 +120,22 @@ class Recipe(models.Model):
     cooking_time = models.PositiveIntegerField(
         verbose_name='Время приготовления'
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения')
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном')
+    thumbnails_source = models.CharField(
+        max_length=100,
+        blank=True,
+        editable=False,
+        verbose_name='Картинка, для которой созданы миниатюры')
+
+    objects = RecipeQuerySet.as_manager()
+
+    counter_fields = ('favorites_count',)
 
     class Meta:
         ordering = ('-id',)
@@ -73,8 +145,9 @@ class Recipe(models.Model):
     def __str__(self) -> str:
         return self.name
 
-    def favorites_count(self):
-        return Favorite.objects.filter(recipe=self.id).count()
+    @property
+    def has_thumbnails(self):
+        return bool(self.image) and self.thumbnails_source == self.image.name
 
 
 class IngredientAmount(models.Model):
@@ -101,6 +174,26 @@ class IngredientAmount(models.Model):
             )
         ]
 
+    def save(self, *args, **kwargs):
+        deltas = Counter({self.ingredient_id: self.amount})
+        if self.pk is not None:
+            deltas.subtract(dict(IngredientAmount.objects.filter(
+                pk=self.pk).values_list('ingredient_id', 'amount')))
+        super().save(*args, **kwargs)
+        Recipe.objects.filter(pk=self.recipe_id).update(
+            updated_at=timezone.now())
+        ShoppingCartItem.objects.change_recipe(self.recipe_id, deltas)
+        RecipeSearch.objects.schedule([self.recipe_id])
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        Recipe.objects.filter(pk=self.recipe_id).update(
+            updated_at=timezone.now())
+        ShoppingCartItem.objects.change_recipe(
+            self.recipe_id, {self.ingredient_id: -self.amount})
+        RecipeSearch.objects.schedule([self.recipe_id])
+        return result
+
 
 class Follow(models.Model):
     user = models.ForeignKey(
@@ -135,6 +228,10 @@ class ShoppingCart(models.Model):
         on_delete=models.CASCADE,
         related_name='in_shopping_cart',
         verbose_name='Рецепт в корзине')
+    created = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Дата добавления')
 
     class Meta:
         verbose_name = 'Список рецептов'
@@ -146,6 +243,136 @@ class ShoppingCart(models.Model):
         ]
 
 
+class ShoppingCartItemManager(models.Manager):
+    """Инкрементальное обновление сумм ингредиентов в корзинах."""
+    batch_size = 500
+
+    def add_recipe(self, user_id, recipe_id, sign=1):
+        self.apply([user_id], {
+            ingredient_id: sign * amount
+            for ingredient_id, amount in IngredientAmount.objects.filter(
+                recipe_id=recipe_id).values_list('ingredient_id', 'amount')
+        })
+
+    def remove_recipe(self, user_id, recipe_id):
+        self.add_recipe(user_id, recipe_id, sign=-1)
+
+    def change_recipe(self, recipe_id, deltas):
+        deltas = {ingredient_id: delta
+                  for ingredient_id, delta in deltas.items() if delta}
+        if deltas:
+            self.apply(ShoppingCart.objects.filter(
+                recipe_id=recipe_id).values_list('user_id', flat=True),
+                deltas)
+
+    def apply(self, user_ids, deltas):
+        user_ids = sorted(set(user_ids))
+        if not user_ids or not deltas:
+            return
+        with transaction.atomic(using=self.db):
+            for start in range(0, len(user_ids), self.batch_size):
+                batch = user_ids[start:start + self.batch_size]
+                self.upsert([
+                    (user_id, ingredient_id, delta)
+                    for user_id in batch
+                    for ingredient_id, delta in sorted(deltas.items())
+                ])
+                # Строки с нулем и отрицательные строки, появившиеся
+                # из-за рассинхронизации, не нужны.
+                self.filter(user_id__in=batch, amount__lte=0).delete()
+
+    def upsert(self, rows):
+        # INSERT ... ON CONFLICT одинаково работает в PostgreSQL и SQLite
+        # и не теряет изменения при одновременных добавлениях в корзину.
+        table = self.model._meta.db_table
+        sql = (
+            f'INSERT INTO {table} (user_id, ingredient_id, amount) '
+            f'VALUES {", ".join(["(%s, %s, %s)"] * len(rows))} '
+            f'ON CONFLICT (user_id, ingredient_id) DO UPDATE '
+            f'SET amount = {table}.amount + excluded.amount')
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, [value for row in rows for value in row])
+
+
+class ShoppingCartItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='cart_items',
+        verbose_name='Покупатель')
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='cart_items',
+        verbose_name='Ингредиент')
+    amount = models.IntegerField(
+        default=0,
+        verbose_name='Количество')
+
+    objects = ShoppingCartItemManager()
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списках покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_user_ingredient_cart_item'
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.ingredient}: {self.amount}'
+
+
+class ExportJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+
+    id = models.UUIDField(
+        primary_key=True,
+        default=uuid.uuid4,
+        editable=False)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='export_jobs',
+        verbose_name='Пользователь')
+    status = models.CharField(
+        max_length=16,
+        choices=STATUSES,
+        default=PENDING,
+        db_index=True,
+        verbose_name='Статус')
+    file = models.FileField(
+        upload_to='exports/',
+        blank=True,
+        verbose_name='Файл')
+    created = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Дата создания')
+    finished_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Дата завершения')
+
+    class Meta:
+        verbose_name = 'Выгрузка списка покупок'
+        verbose_name_plural = 'Выгрузки списков покупок'
+
+    def __str__(self) -> str:
+        return f'{self.user}: {self.get_status_display()}'
+
+
 class Favorite(models.Model):
     user = models.ForeignKey(
         User,
@@ -157,6 +384,10 @@ class Favorite(models.Model):
         related_name='is_favorited',
         on_delete=models.CASCADE,
         verbose_name='Рецепт')
+    created = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Дата добавления')
 
     class Meta:
         verbose_name = 'Избранный'
@@ -166,3 +397,178 @@ class Favorite(models.Model):
                 fields=('user', 'recipe'), name='unique_favorite_recipe'
             )
         ]
+
+
+class RecipePopularity(models.Model):
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='popularity',
+        verbose_name='Рецепт')
+    score = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Популярность')
+    favorites = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Добавлений в избранное')
+    cart_adds = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Добавлений в корзину')
+    dirty = models.BooleanField(
+        default=False,
+        db_index=True,
+        verbose_name='Требует пересчета')
+    refreshed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Дата пересчета')
+
+    class Meta:
+        verbose_name = 'Популярность рецепта'
+        verbose_name_plural = 'Популярность рецептов'
+        indexes = [
+            models.Index(fields=('-score', '-recipe'),
+                         name='api_popularity_score_recipe'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.recipe}: {self.score}'
+
+
+class RecipeSearchManager(models.Manager):
+    """Пересборка поисковых документов рецептов.
+
+    На PostgreSQL документ индексируется колонкой tsvector с GIN-индексом,
+    на SQLite - виртуальной таблицей FTS5 с внешним содержимым, которая
+    читает текст из самих документов. Индексы создаются в post_migrate.
+    """
+    config = 'russian'
+    fts_table = 'api_recipesearch_fts'
+    batch_size = 500
+
+    def schedule(self, recipe_ids):
+        # Ингредиенты рецепта сохраняются после самого рецепта,
+        # поэтому документ собирается после коммита транзакции.
+        recipe_ids = list(recipe_ids)
+        if recipe_ids:
+            transaction.on_commit(lambda: self.rebuild(recipe_ids),
+                                  using=self.db)
+
+    def rebuild(self, recipe_ids):
+        recipe_ids = list(recipe_ids)
+        for start in range(0, len(recipe_ids), self.batch_size):
+            self.rebuild_batch(recipe_ids[start:start + self.batch_size])
+
+    def rebuild_batch(self, recipe_ids):
+        with transaction.atomic(using=self.db):
+            self.rebuild_documents(recipe_ids)
+
+    def rebuild_documents(self, recipe_ids):
+        ingredients = defaultdict(list)
+        for recipe_id, name in IngredientAmount.objects.filter(
+                recipe_id__in=recipe_ids).order_by(
+                    'ingredient__name').values_list(
+                        'recipe_id', 'ingredient__name'):
+            ingredients[recipe_id].append(name)
+        documents = [
+            self.model(recipe_id=recipe_id, name=name, text=text,
+                       ingredients=' '.join(ingredients[recipe_id]))
+            for recipe_id, name, text in Recipe.objects.filter(
+                pk__in=recipe_ids).values_list('pk', 'name', 'text')
+        ]
+        self.unindex(recipe_ids)
+        self.filter(recipe_id__in=recipe_ids).delete()
+        self.bulk_create(documents)
+        self.index(recipe_ids)
+
+    def index(self, recipe_ids):
+        connection = connections[self.db]
+        if connection.vendor == 'postgresql':
+            self.filter(recipe_id__in=recipe_ids).update(vector=(
+                SearchVector('name', weight='A', config=self.config)
+                + SearchVector('ingredients', weight='B', config=self.config)
+                + SearchVector('text', weight='C', config=self.config)))
+        elif connection.vendor == 'sqlite':
+            self.execute_fts(
+                'INSERT INTO {fts} (rowid, name, ingredients, text) '
+                'SELECT recipe_id, name, ingredients, text '
+                'FROM api_recipesearch WHERE recipe_id IN ({ids})',
+                recipe_ids)
+
+    def unindex(self, recipe_ids):
+        # Из FTS5 с внешним содержимым запись удаляется командой 'delete'
+        # со старыми значениями колонок, пока они еще есть в документе.
+        if connections[self.db].vendor == 'sqlite':
+            self.execute_fts(
+                "INSERT INTO {fts} ({fts}, rowid, name, ingredients, text) "
+                "SELECT 'delete', recipe_id, name, ingredients, text "
+                "FROM api_recipesearch WHERE recipe_id IN ({ids})",
+                recipe_ids)
+
+    def execute_fts(self, sql, recipe_ids):
+        if not recipe_ids:
+            return
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql.format(
+                fts=self.fts_table,
+                ids=', '.join(['%s'] * len(recipe_ids))), recipe_ids)
+
+
+class RecipeSearch(models.Model):
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='search_document',
+        verbose_name='Рецепт')
+    name = models.TextField(
+        verbose_name='Название')
+    ingredients = models.TextField(
+        verbose_name='Ингредиенты')
+    text = models.TextField(
+        verbose_name='Описание')
+    vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор')
+
+    objects = RecipeSearchManager()
+
+    class Meta:
+        verbose_name = 'Поисковый документ рецепта'
+        verbose_name_plural = 'Поисковые документы рецептов'
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FullTextField(models.TextField):
+    """Скрытая колонка FTS5 с именем таблицы для оператора MATCH."""
+
+
+@FullTextField.register_lookup
+class Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class RecipeSearchIndex(models.Model):
+    """Таблица FTS5 поиска рецептов на SQLite, только для чтения."""
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column='rowid',
+        db_constraint=False,
+        related_name='search_index')
+    document = FullTextField(db_column=RecipeSearchManager.fts_table)
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = RecipeSearchManager.fts_table
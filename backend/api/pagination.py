@@ -1,7 +1,36 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class CustomPagination(PageNumberPagination):
     page_size = 6
     page_query_param = 'page'
     page_size_query_param = 'limit'
+
+
+class CustomCursorPagination(CursorPagination):
+    page_size = 6
+    page_size_query_param = 'limit'
+    ordering = '-id'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'cursor_ordering', None)
+        if ordering:
+            return ordering
+        return super().get_ordering(request, queryset, view)
+
+
+class CursorPaginationMixin:
+    """Включает курсорную пагинацию, если передан параметр cursor.
+
+    Первая страница запрашивается с пустым ?cursor=, дальше клиент
+    переходит по ссылкам next/previous. Общее количество не считается.
+    """
+    cursor_pagination_class = CustomCursorPagination
+
+    @property
+    def paginator(self):
+        cursor_query_param = self.cursor_pagination_class.cursor_query_param
+        if (not hasattr(self, '_paginator')
+                and cursor_query_param in self.request.query_params):
+            self._paginator = self.cursor_pagination_class()
+        return super().paginator
@@ -0,0 +1,240 @@
+import base64
+import binascii
+import json
+import re
+import uuid
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.utils.datastructures import MultiValueDict
+from PIL import Image
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.parsers import JSONParser
+
+ALLOWED_FORMATS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'GIF': 'gif',
+}
+ESCAPE = re.compile(rb'\\(.)', re.DOTALL)
+WHITESPACE = b' \t\r\n'
+QUOTE, BACKSLASH, COLON, COMMA = b'"\\:,'
+
+
+def image_error(message):
+    return ValidationError({'image': [message]})
+
+
+class Base64ImageWriter:
+    """Декодирует base64 по частям во временный файл.
+
+    Формат и размеры картинки проверяются по заголовку, как только
+    его удается прочитать, поэтому слишком большая картинка отклоняется
+    до того, как будет декодирована целиком.
+    """
+    header_size = 64 * 1024
+    prefix_size = 256
+
+    def __init__(self):
+        self.max_size = settings.RECIPE_IMAGE_MAX_SIZE
+        self.max_pixels = settings.RECIPE_IMAGE_MAX_PIXELS
+        self.file = TemporaryUploadedFile(
+            'image', 'application/octet-stream', 0, None)
+        self.prefix = b''
+        self.pending = b''
+        self.escape = False
+        self.header = bytearray()
+        self.format = None
+        self.size = 0
+
+    def strip_prefix(self, data):
+        if self.prefix is None:
+            return data
+        self.prefix += data
+        if b',' in self.prefix:
+            data = self.prefix.split(b',', 1)[1]
+        elif (len(self.prefix) < self.prefix_size
+                and b'data:'.startswith(self.prefix[:5])):
+            return b''
+        else:
+            data = self.prefix
+        self.prefix = None
+        return data
+
+    def unescape(self, data):
+        if self.escape:
+            data = b'\\' + data
+        trailing = len(data) - len(data.rstrip(b'\\'))
+        self.escape = trailing % 2 == 1
+        if self.escape:
+            data = data[:-1]
+        return ESCAPE.sub(
+            lambda match: b'/' if match.group(1) == b'/' else b'', data)
+
+    def write(self, data):
+        data = self.strip_prefix(self.unescape(data))
+        data = self.pending + data.translate(None, WHITESPACE)
+        usable = len(data) // 4 * 4
+        self.pending = data[usable:]
+        if usable:
+            self.write_decoded(self.decode(data[:usable]))
+
+    def decode(self, data):
+        try:
+            return base64.b64decode(data, validate=True)
+        except binascii.Error:
+            raise image_error('Некорректная картинка')
+
+    def write_decoded(self, decoded):
+        self.size += len(decoded)
+        if self.size > self.max_size:
+            raise image_error('Картинка слишком большая')
+        self.file.write(decoded)
+        if self.format is None and len(self.header) < self.header_size:
+            self.header += decoded
+            if len(self.header) >= self.header_size:
+                self.check(BytesIO(self.header), final=False)
+
+    def check(self, file, final):
+        try:
+            with Image.open(file) as image:
+                image_format, (width, height) = image.format, image.size
+        except Exception:
+            if final:
+                raise image_error('Некорректная картинка')
+            return
+        if image_format not in ALLOWED_FORMATS:
+            raise image_error('Неподдерживаемый формат картинки')
+        if width * height > self.max_pixels:
+            raise image_error('Слишком большое разрешение картинки')
+        self.format = image_format
+
+    def close(self):
+        if self.prefix is not None or self.pending:
+            raise image_error('Некорректная картинка')
+        self.file.flush()
+        if self.format is None:
+            self.file.seek(0)
+            self.check(self.file.file, final=True)
+        self.file.seek(0)
+        self.file.size = self.size
+        self.file.name = f'{uuid.uuid4()}.{ALLOWED_FORMATS[self.format]}'
+        self.file.content_type = Image.MIME[self.format]
+        return self.file
+
+
+class ImageFieldScanner:
+    """Отделяет значение поля с картинкой от остального JSON.
+
+    Остальной документ копируется как есть, а вместо картинки в него
+    подставляется null. Содержимое строки с картинкой передается
+    в Base64ImageWriter и в памяти не накапливается.
+    """
+    max_document_size = 1024 * 1024
+
+    def __init__(self, field):
+        self.key = field.encode()
+        self.document = bytearray()
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.last_key = None
+        self.after_colon = False
+        self.writer = None
+        self.image = None
+
+    def feed(self, chunk):
+        position = 0
+        while position < len(chunk):
+            if self.writer is not None:
+                position = self.feed_image(chunk, position)
+                continue
+            self.feed_byte(chunk[position])
+            position += 1
+        if len(self.document) > self.max_document_size:
+            raise ParseError('Слишком большой запрос')
+
+    def feed_image(self, chunk, position):
+        end = chunk.find(b'"', position)
+        if end == -1:
+            self.writer.write(chunk[position:])
+            return len(chunk)
+        if (chunk[position:end].endswith(b'\\')
+                or end == position and self.writer.escape):
+            raise image_error('Некорректная картинка')
+        self.writer.write(chunk[position:end])
+        self.image = self.writer.close()
+        self.writer = None
+        self.document += b'null'
+        return end + 1
+
+    def feed_byte(self, byte):
+        if self.in_string:
+            self.document.append(byte)
+            if self.escape:
+                self.escape = False
+            elif byte == BACKSLASH:
+                self.escape = True
+            elif byte == QUOTE:
+                self.in_string = False
+                if self.depth == 1 and not self.after_colon:
+                    self.last_key = bytes(
+                        self.document[self.string_start:-1])
+            return
+        if (byte == QUOTE and self.depth == 1 and self.after_colon
+                and self.last_key == self.key and self.image is None):
+            self.writer = Base64ImageWriter()
+            return
+        self.document.append(byte)
+        if byte == QUOTE:
+            self.in_string = True
+            self.string_start = len(self.document)
+        elif byte in b'{[':
+            self.depth += 1
+            if self.depth == 1:
+                self.after_colon = False
+        elif byte in b'}]':
+            self.depth -= 1
+        elif self.depth == 1 and byte == COLON:
+            self.after_colon = True
+        elif self.depth == 1 and byte == COMMA:
+            self.after_colon = False
+            self.last_key = None
+
+    def close(self):
+        if self.writer is not None or self.in_string:
+            raise ParseError('JSON parse error - unterminated string')
+        return bytes(self.document), self.image
+
+
+class RecipeJSONParser(JSONParser):
+    """JSON-парсер, который декодирует картинку рецепта потоково."""
+    image_field = 'image'
+    chunk_size = 64 * 1024
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        scanner = ImageFieldScanner(self.image_field)
+        if stream is not None:
+            while True:
+                chunk = stream.read(self.chunk_size)
+                if not chunk:
+                    break
+                scanner.feed(chunk)
+        document, image = scanner.close()
+        try:
+            data = json.loads(document.decode(encoding))
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+        if image is not None and isinstance(data, dict):
+            data[self.image_field] = image
+            request = parser_context.get('request')
+            if request is not None:
+                # Как и для multipart, Django закроет и удалит временный
+                # файл после ответа.
+                request._request._files = MultiValueDict(
+                    {self.image_field: [image]})
+        return data
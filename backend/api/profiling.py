@@ -0,0 +1,125 @@
+import hashlib
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+
+PLACEHOLDERS = re.compile(r'%s(?:, %s)+')
+
+current_profile = ContextVar('current_profile', default=None)
+
+
+def normalize(sql):
+    # Списки IN (%s, %s, ...) разной длины считаются одним запросом.
+    return PLACEHOLDERS.sub('%s, ...', sql)
+
+
+def fingerprint(sql):
+    return hashlib.sha1(sql.encode()).hexdigest()[:12]
+
+
+class RequestProfile:
+    """Запросы к базе и замеры времени в рамках одного HTTP-запроса."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+        self.timers = defaultdict(float)
+        self._depth = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            self.statements[normalize(sql)] += 1
+
+    @contextmanager
+    def activate(self):
+        token = current_profile.set(self)
+        try:
+            with self.capture():
+                yield self
+        finally:
+            current_profile.reset(token)
+
+    @contextmanager
+    def capture(self):
+        # Соединения у каждого потока свои, поэтому в потоке, где
+        # выполняется представление, обертки ставятся заново.
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    @contextmanager
+    def timer(self, name):
+        # Вложенные замеры с тем же именем не учитываются повторно.
+        self._depth[name] += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._depth[name] -= 1
+            if not self._depth[name]:
+                self.timers[name] += time.perf_counter() - start
+
+    @property
+    def duration(self):
+        return time.perf_counter() - self.start
+
+    def duplicates(self):
+        return [(sql, count) for sql, count in self.statements.most_common()
+                if count > 1]
+
+    def server_timing(self):
+        duplicates = self.duplicates()
+        metrics = [
+            f'total;dur={self.duration * 1000:.1f}',
+            f'db;dur={self.db_time * 1000:.1f};'
+            f'desc="{self.queries} queries, {len(duplicates)} duplicated"',
+        ]
+        metrics.extend(f'{name};dur={value * 1000:.1f}'
+                       for name, value in self.timers.items())
+        return ', '.join(metrics)
+
+    def as_dict(self, limit=5):
+        return {
+            'duration_ms': round(self.duration * 1000, 1),
+            'queries': self.queries,
+            'db_ms': round(self.db_time * 1000, 1),
+            **{f'{name}_ms': round(value * 1000, 1)
+               for name, value in self.timers.items()},
+            'duplicates': [
+                {'fingerprint': fingerprint(sql), 'count': count,
+                 'sql': sql[:300]}
+                for sql, count in self.duplicates()[:limit]
+            ],
+        }
+
+
+@contextmanager
+def timer(name):
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    with profile.timer(name):
+        yield
+
+
+@contextmanager
+def capture_queries():
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    with profile.capture():
+        yield
@@ -0,0 +1,132 @@
+import csv
+import io
+import os
+
+from django.conf import settings
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.units import inch
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework import renderers
+
+from .profiling import timer
+
+FONT_NAME = 'FreeSans'
+FONT_PATH = os.path.join(settings.BASE_DIR, 'FreeSans.ttf')
+
+
+def register_fonts():
+    if FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_PATH))
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer(renderers.BaseRenderer):
+    charset = 'utf-8'
+    streaming = False
+    cached = False
+
+    def lines(self, ingredients):
+        for ingredient in ingredients:
+            yield (f'{ingredient["name"].capitalize()}'
+                   f' ({ingredient["measurement_unit"]})'
+                   f' - {ingredient["total_amount"]}')
+
+
+class PDFShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    render_style = 'binary'
+    cached = True
+    lines_per_page = 36
+    font_size = 15
+
+    def new_page(self, c):
+        textob = c.beginText()
+        textob.setTextOrigin(inch, inch)
+        textob.setFont(FONT_NAME, self.font_size)
+        return textob
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timer('render'):
+            return self.render_pdf(data)
+
+    def render_pdf(self, data):
+        buf = io.BytesIO()
+        c = canvas.Canvas(buf, pagesize=letter, bottomup=0)
+        textob = self.new_page(c)
+        for index, line in enumerate(self.lines(data)):
+            if index and index % self.lines_per_page == 0:
+                c.drawText(textob)
+                c.showPage()
+                textob = self.new_page(c)
+            textob.textLine(line)
+        c.drawText(textob)
+        c.showPage()
+        c.save()
+        return buf.getvalue()
+
+
+def render_shopping_list_pdf(ingredients):
+    # Выполняется в дочернем процессе api.exports, где AppConfig.ready
+    # не вызывался и шрифт еще не зарегистрирован.
+    register_fonts()
+    return PDFShoppingListRenderer().render_pdf(ingredients)
+
+
+class StreamingShoppingListRenderer(ShoppingListRenderer):
+    """Текстовый формат, который можно отдавать по частям из stream()."""
+    streaming = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return ''.join(self.stream(data)).encode(self.charset)
+
+
+class TextShoppingListRenderer(StreamingShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        for line in self.lines(ingredients):
+            yield f'{line}\n'
+
+
+class CSVShoppingListRenderer(StreamingShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    header = ('name', 'measurement_unit', 'amount')
+
+    def stream(self, ingredients):
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.header)
+        for ingredient in ingredients:
+            yield writer.writerow((ingredient['name'],
+                                   ingredient['measurement_unit'],
+                                   ingredient['total_amount']))
+
+
+class JSONShoppingListRenderer(renderers.JSONRenderer):
+    streaming = False
+    cached = False
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, dict):
+            data = [{'name': ingredient['name'],
+                     'measurement_unit': ingredient['measurement_unit'],
+                     'amount': ingredient['total_amount']}
+                    for ingredient in data]
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+SHOPPING_LIST_RENDERERS = (
+    PDFShoppingListRenderer,
+    TextShoppingListRenderer,
+    CSVShoppingListRenderer,
+    JSONShoppingListRenderer,
+)
@@ -0,0 +1,91 @@
+import bisect
+import re
+import threading
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import Case, F, IntegerField, When
+
+from .cache import catalog_cache
+from .models import Ingredient, RecipeSearch
+
+WORDS = re.compile(r'\w+')
+
+
+def fold(value):
+    return value.casefold()
+
+
+class IngredientPrefixIndex:
+    """Отсортированный список названий ингредиентов для поиска в SQLite."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._entries = None
+
+    def entries(self):
+        version = catalog_cache.version('ingredients')
+        with self._lock:
+            if self._version != version:
+                self._entries = sorted(
+                    (fold(name), pk) for pk, name in
+                    Ingredient.objects.values_list('pk', 'name'))
+                self._version = version
+            return self._entries
+
+    def search(self, query, limit=None):
+        entries = self.entries()
+        found = []
+        index = bisect.bisect_left(entries, (query,))
+        while index < len(entries) and entries[index][0].startswith(query):
+            found.append(entries[index][1])
+            if len(found) == limit:
+                return found
+            index += 1
+        for name, pk in entries:
+            if query in name and not name.startswith(query):
+                found.append(pk)
+                if len(found) == limit:
+                    break
+        return found
+
+
+ingredient_index = IngredientPrefixIndex()
+
+
+def search_ingredients(queryset, query, limit=None):
+    if connection.vendor == 'postgresql':
+        queryset = queryset.filter(name__icontains=query).annotate(
+            prefix_rank=Case(When(name__istartswith=query, then=0),
+                             default=1, output_field=IntegerField())
+        ).order_by('prefix_rank', 'name')
+        return queryset[:limit] if limit else queryset
+    ids = ingredient_index.search(fold(query), limit)
+    if not ids:
+        return queryset.none()
+    return queryset.filter(pk__in=ids).order_by(
+        Case(*(When(pk=pk, then=position)
+               for position, pk in enumerate(ids)),
+             output_field=IntegerField()))
+
+
+def match_expression(query):
+    # Каждое слово ищется как префикс: в SQLite нет русского стемминга.
+    return ' '.join(f'"{word}"*' for word in WORDS.findall(query))
+
+
+def search_recipes(queryset, query):
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(query, config=RecipeSearch.objects.config,
+                                   search_type='websearch')
+        return queryset.filter(search_document__vector=search_query).annotate(
+            search_rank=SearchRank(F('search_document__vector'),
+                                   search_query)
+        ).order_by('-search_rank', '-id')
+    expression = match_expression(query)
+    if not expression:
+        return queryset.none()
+    # rank в FTS5 - это bm25 со знаком минус: чем меньше, тем лучше.
+    return queryset.filter(search_index__document__match=expression).annotate(
+        search_rank=F('search_index__rank')).order_by('search_rank', '-id')
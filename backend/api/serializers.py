@@ -1,13 +1,33 @@
+from collections import Counter
+
+from django.core.files.storage import default_storage
+from django.db import transaction
 from django.forms import ValidationError
-from django.shortcuts import get_object_or_404
 from djoser.serializers import UserSerializer
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
+from rest_framework.reverse import reverse
+
+from .feeds import get_recipes_limit
+from .fields import RecipeImageField
+from .images import THUMBNAIL_FORMATS, THUMBNAIL_SIZES, thumbnail_name
+from .models import (ExportJob, Follow, Ingredient, IngredientAmount, Recipe,
+                     ShoppingCartItem, Tag, User)
+from .profiling import timer
+
+
+class TimedSerializerMixin:
+    """Учитывает время сериализации в профиле запроса."""
+
+    def to_representation(self, instance):
+        with timer('serializer'):
+            return super().to_representation(instance)
 
-from .models import Follow, Ingredient, IngredientAmount, Recipe, Tag, User
+    def run_validation(self, data=serializers.empty):
+        with timer('serializer'):
+            return super().run_validation(data)
 
 
-class ProfileSerializer(UserSerializer):
+class ProfileSerializer(TimedSerializerMixin, UserSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -18,6 +38,8 @@ class ProfileSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed_annotated'):
+            return obj.is_subscribed_annotated
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
@@ -25,17 +47,18 @@ class ProfileSerializer(UserSerializer):
             return obj.following.filter(author=obj.id, user=request.user).exists()
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Tag
         fields = '__all__'
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin,
+                           serializers.ModelSerializer):
 
     class Meta:
         model = Ingredient
-        fields = '__all__'
+        fields = ('id', 'name', 'measurement_unit')
 
 
 class IngredientAmountSerializer(serializers.ModelSerializer):
@@ -56,43 +79,74 @@ class IngredientInRecipeRepresentation(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class ThumbnailsMixin(serializers.Serializer):
+    thumbnails = serializers.SerializerMethodField()
+
+    def get_thumbnails(self, obj):
+        if not obj.has_thumbnails:
+            return None
+        request = self.context.get('request')
+        thumbnails = {}
+        for size in THUMBNAIL_SIZES:
+            thumbnails[size] = {}
+            for extension in THUMBNAIL_FORMATS:
+                url = default_storage.url(
+                    thumbnail_name(obj.image.name, size, extension))
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                thumbnails[size][extension] = url
+        return thumbnails
+
+
+class RecipeSerializer(TimedSerializerMixin, ThumbnailsMixin,
+                       serializers.ModelSerializer):
     author = ProfileSerializer(read_only=True)
     tags = TagSerializer(many=True)
     ingredients = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
-    image = Base64ImageField()
+    image = RecipeImageField()
 
     class Meta:
         model = Recipe
-        fields = '__all__'
+        exclude = ('updated_at', 'favorites_count', 'thumbnails_source')
+
+    def to_representation(self, instance):
+        if hasattr(instance, 'is_subscribed_annotated'):
+            instance.author.is_subscribed_annotated = (
+                instance.is_subscribed_annotated)
+        return super().to_representation(instance)
 
     def get_ingredients(self, obj):
-        data = IngredientAmount.objects.filter(recipe=obj)
+        data = obj.ingredientamount_set.all()
         return IngredientAmountSerializer(data, many=True).data
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited_annotated'):
+            return obj.is_favorited_annotated
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
         return obj.is_favorited.filter(user=user).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart_annotated'):
+            return obj.is_in_shopping_cart_annotated
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
         return obj.in_shopping_cart.filter(user=user).exists()
 
 
-class RecipeCreateSerializer(serializers.ModelSerializer):
-    image = Base64ImageField()
+class RecipeCreateSerializer(TimedSerializerMixin,
+                             serializers.ModelSerializer):
+    image = RecipeImageField()
     author = ProfileSerializer(read_only=True)
     ingredients = IngredientAmountSerializer(many=True)
 
     class Meta:
         model = Recipe
-        fields = '__all__'
+        exclude = ('updated_at', 'favorites_count', 'thumbnails_source')
 
     def validate(self, attrs):
         if len(attrs['ingredients']) == 0:
@@ -104,6 +158,9 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             ingredients_id.append(ingredient['ingredient']['id'])
         if len(ingredients_id) > len(set(ingredients_id)):
             raise ValidationError('Ингредиенты не могут повторяться')
+        if len(Ingredient.objects.in_bulk(ingredients_id)) < len(
+                ingredients_id):
+            raise ValidationError('Такого ингредиента не существует')
         if attrs['cooking_time'] <= 0:
             raise ValidationError('Время приготовления не может быть меньше 0')
         if len(attrs['tags']) < 0:
@@ -112,18 +169,41 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             raise ValidationError('Теги не могут повторяться')
         return attrs
 
+    def set_ingredients(self, obj, ingredients):
+        amounts = {ingredient['ingredient']['id']: ingredient['amount']
+                   for ingredient in ingredients}
+        current = {amount.ingredient_id: amount
+                   for amount in obj.ingredientamount_set.all()}
+        deltas = Counter(amounts)
+        deltas.subtract({ingredient_id: amount.amount
+                         for ingredient_id, amount in current.items()})
+        removed = current.keys() - amounts.keys()
+        if removed:
+            IngredientAmount.objects.filter(
+                recipe=obj, ingredient_id__in=removed).delete()
+        changed = []
+        for ingredient_id, amount in amounts.items():
+            if (ingredient_id in current
+                    and current[ingredient_id].amount != amount):
+                current[ingredient_id].amount = amount
+                changed.append(current[ingredient_id])
+        if changed:
+            IngredientAmount.objects.bulk_update(changed, ('amount',))
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(recipe=obj, ingredient_id=ingredient_id,
+                             amount=amount)
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in current)
+        if self.instance is not None:
+            ShoppingCartItem.objects.change_recipe(obj.pk, deltas)
+        return obj
+
     def set_tags_ingredients(self, obj, tags, ingredients):
         obj.tags.set(tags)
-        for ingredient in ingredients:
-            IngredientAmount.objects.create(
-                recipe=obj,
-                ingredient=get_object_or_404(Ingredient,
-                                             id=ingredient['ingredient']['id']
-                                             ),
-                amount=ingredient.get('amount')
-            )
+        self.set_ingredients(obj, ingredients)
         return obj
 
+    @transaction.atomic
     def create(self, validated_data):
         author = self.context.get('request').user
         ingredients = validated_data.pop('ingredients')
@@ -137,32 +217,35 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         self.set_tags_ingredients(recipe, tags, ingredients)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.tags.remove()
-        instance.ingredients.remove()
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         super().update(instance, validated_data)
-        IngredientAmount.objects.filter(recipe=instance).delete()
         self.set_tags_ingredients(instance, tags, ingredients)
         return instance
 
     def to_representation(self, instance):
+        request = self.context.get('request')
+        instance = Recipe.objects.with_related().with_user_flags(
+            request.user).get(pk=instance.pk)
         return RecipeSerializer(
             instance,
-            context={'request': self.context.get('request')}).data
+            context={'request': request}).data
 
 
-class RecipeInfoSerializer(serializers.ModelSerializer):
+class RecipeInfoSerializer(TimedSerializerMixin, ThumbnailsMixin,
+                           serializers.ModelSerializer):
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'thumbnails', 'cooking_time')
 
 
-class SubscribersSerializer(serializers.ModelSerializer):
+class SubscribersSerializer(TimedSerializerMixin,
+                            serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
 
     class Meta:
         model = User
@@ -170,6 +253,8 @@ class SubscribersSerializer(serializers.ModelSerializer):
                   'is_subscribed', 'recipes', 'recipes_count')
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed_annotated'):
+            return obj.is_subscribed_annotated
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
@@ -177,16 +262,18 @@ class SubscribersSerializer(serializers.ModelSerializer):
             return obj.following.filter(author=obj.id, user=request.user).exists()
 
     def get_recipes(self, obj):
-        recipes = obj.recipes.all()[:3]
         request = self.context.get('request')
+        recipes_by_author = self.context.get('recipes_by_author')
+        if recipes_by_author is not None:
+            recipes = recipes_by_author.get(obj.id, [])
+        else:
+            recipes = obj.recipes.all()[:get_recipes_limit(request)]
         context = {'request': request}
         return RecipeInfoSerializer(recipes, many=True, context=context).data
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
 
-
-class FollowUnfollowSerializer(serializers.ModelSerializer):
+class FollowUnfollowSerializer(TimedSerializerMixin,
+                               serializers.ModelSerializer):
     queryset = User.objects.all()
     user = serializers.PrimaryKeyRelatedField(queryset=queryset)
     author = serializers.PrimaryKeyRelatedField(queryset=queryset)
@@ -194,3 +281,17 @@ class FollowUnfollowSerializer(serializers.ModelSerializer):
     class Meta:
         model = Follow
         fields = ('user', 'author')
+
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ExportJob
+        fields = ('id', 'status', 'created', 'finished_at', 'download_url')
+
+    def get_download_url(self, obj):
+        if obj.status != ExportJob.DONE:
+            return None
+        return reverse('exports-download', args=(obj.pk,),
+                       request=self.context.get('request'))
@@ -0,0 +1,15 @@
+from django.db.models import F, IntegerField, Sum
+
+from .models import ShoppingCartItem
+
+
+def get_shopping_list(user):
+    # Количества переводятся в каноническую единицу прямо в запросе,
+    # поэтому "кг" и "г" одного ингредиента дают одну строку.
+    return ShoppingCartItem.objects.filter(user=user).values(
+        name=F('ingredient__name'),
+        measurement_unit=F('ingredient__canonical_unit')
+    ).annotate(
+        total_amount=Sum(F('amount') * F('ingredient__unit_factor'),
+                         output_field=IntegerField())
+    ).order_by('name', 'measurement_unit')
@@ -0,0 +1,249 @@
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_migrate,
+                                      post_save, pre_delete)
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .authentication import CachedTokenAuthentication
+from .cache import catalog_cache, membership_cache
+from .images import schedule_thumbnails
+from .models import (Favorite, Follow, Ingredient, IngredientAmount, Recipe,
+                     RecipePopularity, RecipeSearch, ShoppingCart,
+                     ShoppingCartItem, Tag, User)
+
+
+@receiver(post_migrate)
+def create_indexes(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    if sender.name != 'api':
+        return
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS api_recipe_tags_tag_recipe '
+            'ON api_recipe_tags (tag_id, recipe_id)')
+        if connection.vendor == 'sqlite':
+            create_search_table(cursor)
+        if connection.vendor != 'postgresql':
+            return
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS api_ingredient_name_trgm '
+            'ON api_ingredient USING gin (UPPER(name::text) gin_trgm_ops)')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS api_recipesearch_vector '
+            'ON api_recipesearch USING gin (vector)')
+
+
+def create_search_table(cursor):
+    table = RecipeSearch.objects.fts_table
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+        [table])
+    if cursor.fetchone():
+        return
+    cursor.execute(
+        f'CREATE VIRTUAL TABLE {table} USING fts5('
+        "name, ingredients, text, content='api_recipesearch', "
+        "content_rowid='recipe_id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+    # Совпадение в названии важнее, чем в ингредиентах и описании.
+    cursor.execute(
+        f"INSERT INTO {table} ({table}, rank) "
+        "VALUES ('rank', 'bm25(10.0, 5.0, 1.0)')")
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tags(**kwargs):
+    # До фиксации параллельный запрос собрал бы ответ из старых строк
+    # и сохранил его под новой версией.
+    transaction.on_commit(lambda: catalog_cache.invalidate('tags'))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredients(**kwargs):
+    transaction.on_commit(lambda: catalog_cache.invalidate('ingredients'))
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def invalidate_favorite_membership(instance, **kwargs):
+    membership_cache.invalidate('favorite', instance.user_id)
+
+
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def invalidate_shopping_cart_membership(instance, **kwargs):
+    membership_cache.invalidate('shopping_cart', instance.user_id)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_membership(instance, **kwargs):
+    membership_cache.invalidate('follow', instance.user_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def touch_recipe_on_tags(instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        recipes = Recipe.objects.filter(pk=instance.pk)
+    elif action == 'pre_clear':
+        recipes = Recipe.objects.filter(tags=instance)
+    else:
+        recipes = Recipe.objects.filter(pk__in=pk_set)
+    recipes.update(updated_at=timezone.now())
+
+
+# Поля автора, которые попадают в ответы с рецептами.
+PROFILE_FIELDS = frozenset(('email', 'username', 'first_name', 'last_name'))
+
+
+def touch_recipes(recipes):
+    # ETag рецептов строится по updated_at, поэтому он сдвигается при
+    # изменении всего, что попадает в тело ответа.
+    recipes.update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def touch_recipes_on_tag(instance, created=False, **kwargs):
+    if not created:
+        touch_recipes(Recipe.objects.filter(tags=instance))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def touch_recipes_on_ingredient(instance, created=False, **kwargs):
+    if not created:
+        touch_recipes(Recipe.objects.filter(
+            ingredientamount__ingredient=instance))
+
+
+@receiver(post_save, sender=User)
+def touch_recipes_on_profile(instance, created, update_fields, **kwargs):
+    if created or (update_fields is not None
+                   and not PROFILE_FIELDS.intersection(update_fields)):
+        return
+    touch_recipes(Recipe.objects.filter(author=instance))
+
+
+def change_counter(queryset, field, delta):
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+@receiver(post_save, sender=Favorite)
+def increment_favorites_count(instance, created, **kwargs):
+    if created:
+        change_counter(Recipe.objects.filter(pk=instance.recipe_id),
+                       'favorites_count', 1)
+
+
+@receiver(post_delete, sender=Favorite)
+def decrement_favorites_count(instance, **kwargs):
+    change_counter(Recipe.objects.filter(pk=instance.recipe_id),
+                   'favorites_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def process_recipe_image(instance, update_fields, **kwargs):
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    if instance.image and not instance.has_thumbnails:
+        schedule_thumbnails(instance.image.name)
+
+
+@receiver(post_save, sender=Recipe)
+def create_recipe_popularity(instance, created, **kwargs):
+    if created:
+        RecipePopularity.objects.create(recipe=instance)
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search(instance, **kwargs):
+    RecipeSearch.objects.schedule([instance.pk])
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_carts(instance, **kwargs):
+    # Корзины удаляются до ингредиентов рецепта, иначе суммы
+    # в списках покупок будет не из чего уменьшить.
+    ShoppingCart.objects.filter(recipe=instance).delete()
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_cart_items(instance, created, **kwargs):
+    if created:
+        ShoppingCartItem.objects.add_recipe(instance.user_id,
+                                            instance.recipe_id)
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def remove_cart_items(instance, **kwargs):
+    ShoppingCartItem.objects.remove_recipe(instance.user_id,
+                                           instance.recipe_id)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_search(instance, **kwargs):
+    RecipeSearch.objects.unindex([instance.pk])
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def update_ingredient_search(instance, created=False, **kwargs):
+    if not created:
+        RecipeSearch.objects.schedule(IngredientAmount.objects.filter(
+            ingredient=instance).values_list('recipe_id', flat=True))
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def mark_popularity_dirty(instance, created=True, **kwargs):
+    if created:
+        RecipePopularity.objects.filter(
+            recipe_id=instance.recipe_id, dirty=False).update(dirty=True)
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(instance, created, **kwargs):
+    if created:
+        change_counter(User.objects.filter(pk=instance.author_id),
+                       'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(instance, **kwargs):
+    change_counter(User.objects.filter(pk=instance.author_id),
+                   'recipes_count', -1)
+
+
+@receiver(post_save, sender=Follow)
+def increment_followers_count(instance, created, **kwargs):
+    if created:
+        change_counter(User.objects.filter(pk=instance.author_id),
+                       'followers_count', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def decrement_followers_count(instance, **kwargs):
+    change_counter(User.objects.filter(pk=instance.author_id),
+                   'followers_count', -1)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(instance, **kwargs):
+    CachedTokenAuthentication.invalidate([instance.key])
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(instance, **kwargs):
+    CachedTokenAuthentication.invalidate_user(instance)
@@ -0,0 +1,789 @@
+import base64
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.test import APIClient
+
+from .authentication import CachedTokenAuthentication, token_cache_key
+from .cache import MEMBERSHIP_KEY, catalog_cache, membership_cache
+from .exports import run_job
+from .filters import IngredientFilter
+from .images import generate_thumbnails
+from .models import (ExportJob, Favorite, Follow, Ingredient, IngredientAmount,
+                     Recipe, RecipeSearch, ShoppingCart, ShoppingCartItem, Tag,
+                     User)
+from .parsers import Base64ImageWriter, ImageFieldScanner, RecipeJSONParser
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def make_image():
+    buffer = BytesIO()
+    Image.new('RGB', (8, 8), (200, 120, 40)).save(buffer, 'PNG')
+    return ('data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+
+def noise_png(width, height):
+    buffer = BytesIO()
+    pixels = random.Random(width * height).randbytes(width * height * 3)
+    Image.frombytes('RGB', (width, height), pixels).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class APITestCase(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        # Сброс справочников и множеств выполняется после фиксации,
+        # которой в TestCase нет.
+        cache.clear()
+        # Картинки рецептов в тестах не существуют.
+        patcher = mock.patch('api.signals.schedule_thumbnails')
+        self.schedule_thumbnails = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия', password='password')
+        self.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Имя', last_name='Фамилия', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.tags = [
+            Tag.objects.create(name=f'Тег {index}', color=f'#00000{index}',
+                               slug=f'tag-{index}')
+            for index in range(2)
+        ]
+        self.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {index}',
+                                      measurement_unit='г')
+            for index in range(5)
+        ]
+
+    def create_recipe(self, name='Рецепт', ingredients=3):
+        recipe = Recipe.objects.create(
+            author=self.author, name=name, image='recipes/image.png',
+            text='Описание', cooking_time=10)
+        recipe.tags.set(self.tags)
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(recipe=recipe, ingredient=ingredient,
+                             amount=100)
+            for ingredient in self.ingredients[:ingredients])
+        return recipe
+
+
+class RecipeListQueriesTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        recipes = [self.create_recipe(f'Рецепт {index}')
+                   for index in range(50)]
+        Follow.objects.create(user=self.user, author=self.author)
+        for recipe in recipes[::2]:
+            Favorite.objects.create(user=self.user, recipe=recipe)
+            ShoppingCart.objects.create(user=self.user, recipe=recipe)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        for limit in (6, 50):
+            with self.subTest(limit=limit), self.assertNumQueries(5):
+                response = self.client.get(f'/api/recipes/?limit={limit}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), limit)
+        results = response.data['results']
+        self.assertEqual(
+            sum(recipe['is_favorited'] for recipe in results), 25)
+        self.assertEqual(
+            sum(recipe['is_in_shopping_cart'] for recipe in results), 25)
+        self.assertTrue(
+            all(recipe['author']['is_subscribed'] for recipe in results))
+
+
+class RecipeWriteQueriesTest(APITestCase):
+
+    def payload(self, amounts):
+        return {
+            'name': 'Новый рецепт',
+            'text': 'Описание',
+            'cooking_time': 15,
+            'image': make_image(),
+            'tags': [tag.id for tag in self.tags],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': amount}
+                for ingredient, amount in amounts
+            ],
+        }
+
+    def test_create_query_count(self):
+        for count in (2, 5):
+            amounts = [(ingredient, 10) for ingredient in
+                       self.ingredients[:count]]
+            with self.subTest(ingredients=count), self.assertNumQueries(17):
+                response = self.client.post(
+                    '/api/recipes/', self.payload(amounts), format='json')
+            self.assertEqual(response.status_code, 201, response.data)
+            self.assertEqual(len(response.data['ingredients']), count)
+
+    def test_patch_changes_only_affected_amounts(self):
+        self.author = self.user
+        recipe = self.create_recipe(ingredients=3)
+        before = {amount.ingredient_id: amount for amount in
+                  IngredientAmount.objects.filter(recipe=recipe)}
+        first, second, third, fourth = self.ingredients[:4]
+        amounts = [(first, 250), (second, 100), (fourth, 30)]
+        with self.assertNumQueries(17) as context:
+            response = self.client.patch(
+                f'/api/recipes/{recipe.id}/', self.payload(amounts),
+                format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        writes = [
+            query['sql'].split()[0] for query in context.captured_queries
+            if query['sql'].split()[0] in ('INSERT', 'UPDATE', 'DELETE')
+            and 'api_ingredientamount' in query['sql'].split('WHERE')[0]
+        ]
+        self.assertEqual(sorted(writes), ['DELETE', 'INSERT', 'UPDATE'])
+        after = {amount.ingredient_id: amount for amount in
+                 IngredientAmount.objects.filter(recipe=recipe)}
+        self.assertEqual(set(after), {first.id, second.id, fourth.id})
+        self.assertEqual(after[first.id].pk, before[first.id].pk)
+        self.assertEqual(after[first.id].amount, 250)
+        self.assertEqual(after[second.id].pk, before[second.id].pk)
+        self.assertEqual(after[second.id].amount, 100)
+        self.assertNotIn(after[fourth.id].pk,
+                         {amount.pk for amount in before.values()})
+        self.assertEqual(after[fourth.id].amount, 30)
+
+
+class IngredientSearchTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Соль {index:03}', measurement_unit='г')
+            for index in range(120))
+        Ingredient.objects.create(name='Морская соль', measurement_unit='г')
+
+    def search(self, query):
+        response = self.client.get(f'/api/ingredients/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.data]
+
+    def test_results_are_limited_by_default(self):
+        names = self.search('name=соль')
+        self.assertEqual(len(names), IngredientFilter.default_limit)
+        self.assertEqual(names[0], 'Соль 000')
+
+    def test_limit_is_capped(self):
+        names = self.search('name=соль&limit=1000')
+        self.assertEqual(len(names), IngredientFilter.max_limit)
+        self.assertEqual(len(self.search('name=соль&limit=5')), 5)
+
+    def test_substring_matches_follow_prefix_matches(self):
+        names = self.search('name=соль&limit=100')
+        self.assertNotIn('Морская соль', names)
+        names = self.search('name=морск')
+        self.assertEqual(names, ['Морская соль'])
+
+
+class CatalogCacheTest(APITestCase):
+
+    def test_loaddata_invalidates_ingredients(self):
+        Ingredient.objects.all().delete()
+        self.assertEqual(self.client.get('/api/ingredients/').json(), [])
+        self.assertEqual(
+            self.client.get('/api/ingredients/?name=мука').data, [])
+        path = os.path.join(MEDIA_ROOT, 'ingredients.csv')
+        with open(path, 'w', encoding='utf8') as file:
+            file.write('мука,г\nсахар,г\n')
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('loaddata', path, stdout=StringIO())
+        response = self.client.get('/api/ingredients/')
+        self.assertEqual(
+            [ingredient['name'] for ingredient in response.json()],
+            ['мука', 'сахар'])
+        response = self.client.get('/api/ingredients/?name=мука')
+        self.assertEqual(len(response.data), 1)
+
+    def test_tag_change_invalidates_after_commit(self):
+        self.client.get('/api/tags/')
+        version = catalog_cache.version('tags')
+        tag = self.tags[0]
+        tag.name = 'Новый тег'
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                tag.save()
+                # Параллельный запрос до фиксации видит прежнюю версию
+                # и не кеширует старые строки под новой.
+                self.assertEqual(catalog_cache.version('tags'), version)
+        self.assertNotEqual(catalog_cache.version('tags'), version)
+        response = self.client.get('/api/tags/')
+        self.assertIn('Новый тег',
+                      [tag['name'] for tag in response.json()])
+
+
+class RecipeSearchTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe = self.create_recipe('Борщ украинский')
+            self.recipe.text = 'Свекла и капуста'
+            self.recipe.save()
+            self.other = self.create_recipe('Салат', ingredients=1)
+
+    def search(self, query):
+        response = self.client.get('/api/recipes/', {'search': query})
+        self.assertEqual(response.status_code, 200)
+        self.assertIndexConsistent()
+        return [recipe['name'] for recipe in response.data['results']]
+
+    def assertIndexConsistent(self):
+        if connection.vendor != 'sqlite':
+            return
+        table = RecipeSearch.objects.fts_table
+        with connection.cursor() as cursor:
+            # Сверяет индекс FTS5 с документами в api_recipesearch.
+            cursor.execute(f"INSERT INTO {table} ({table}, rank) "
+                           "VALUES ('integrity-check', 1)")
+
+    def test_create(self):
+        self.assertEqual(self.search('борщ'), ['Борщ украинский'])
+        if connection.vendor == 'sqlite':
+            # Без стемминга слова ищутся как префиксы.
+            self.assertEqual(self.search('укр'), ['Борщ украинский'])
+        self.assertEqual(self.search('свекла'), ['Борщ украинский'])
+        self.assertEqual(self.search('ингредиент 2'), ['Борщ украинский'])
+
+    def test_name_ranks_above_ingredients(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.name = 'Салат с ингредиентом'
+            self.other.save()
+        self.assertEqual(self.search('ингредиент'),
+                         ['Салат с ингредиентом', 'Борщ украинский'])
+
+    def test_rename(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.name = 'Щи'
+            self.recipe.save()
+        self.assertEqual(self.search('борщ'), [])
+        self.assertEqual(self.search('щи'), ['Щи'])
+
+    def test_ingredient_rename(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient = self.ingredients[2]
+            ingredient.name = 'Фасоль'
+            ingredient.save()
+        self.assertEqual(self.search('фасоль'), ['Борщ украинский'])
+        self.assertEqual(self.search('ингредиент 2'), [])
+
+    def test_delete(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.delete()
+        self.assertEqual(self.search('борщ'), [])
+        self.assertEqual(self.search('ингредиент 0'), ['Салат'])
+
+    def test_query_syntax_is_escaped(self):
+        for query in ('"', 'борщ" OR "салат', 'NEAR(борщ салат)', '*',
+                      'name:салат', "'", '^борщ'):
+            with self.subTest(query=query):
+                self.assertNotIn('Салат', self.search(query))
+        self.assertEqual(self.search('"борщ"'), ['Борщ украинский'])
+
+
+class ShoppingCartAggregateTest(APITestCase):
+
+    def assertNoDrift(self):
+        output = StringIO()
+        call_command('recount_shopping_cart', '--dry-run', stdout=output)
+        self.assertEqual(output.getvalue().strip(),
+                         'Списки покупок с расхождениями: 0')
+
+    def toggle(self, client, recipe, method='post'):
+        response = getattr(client, method)(
+            f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.assertIn(response.status_code, (201, 204), response.data)
+
+    def test_incremental_totals_match_recount(self):
+        first = self.create_recipe('Первый', ingredients=3)
+        second = self.create_recipe('Второй', ingredients=5)
+        author = APIClient()
+        author.force_authenticate(self.author)
+        self.toggle(self.client, first)
+        self.toggle(self.client, second)
+        self.toggle(author, first)
+        self.assertNoDrift()
+
+        response = author.patch(f'/api/recipes/{first.id}/', {
+            'name': first.name,
+            'text': first.text,
+            'cooking_time': first.cooking_time,
+            'image': make_image(),
+            'tags': [tag.id for tag in self.tags],
+            'ingredients': [
+                {'id': self.ingredients[0].id, 'amount': 250},
+                {'id': self.ingredients[1].id, 'amount': 100},
+                {'id': self.ingredients[4].id, 'amount': 30},
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertNoDrift()
+
+        amount = IngredientAmount.objects.get(
+            recipe=second, ingredient=self.ingredients[3])
+        amount.amount = 7
+        amount.save()
+        IngredientAmount.objects.get(
+            recipe=second, ingredient=self.ingredients[2]).delete()
+        IngredientAmount(recipe=first, ingredient=self.ingredients[2],
+                         amount=15).save()
+        self.assertNoDrift()
+
+        self.toggle(self.client, second, 'delete')
+        self.assertNoDrift()
+        first.delete()
+        self.assertNoDrift()
+        self.assertFalse(ShoppingCartItem.objects.exists())
+
+        self.toggle(self.client, second)
+        ShoppingCartItem.objects.filter(user=self.user).update(amount=1)
+        output = StringIO()
+        call_command('recount_shopping_cart', '--dry-run', stdout=output)
+        self.assertIn(': 1', output.getvalue())
+
+
+class ConditionalRequestTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        buffer = BytesIO()
+        Image.new('RGB', (64, 64), (200, 120, 40)).save(buffer, 'PNG')
+        self.recipe = self.create_recipe()
+        self.recipe.image = default_storage.save(
+            'recipes/image.png', ContentFile(buffer.getvalue()))
+        self.recipe.save()
+        self.url = f'/api/recipes/{self.recipe.id}/'
+
+    def assertModified(self, url, modified=True):
+        etag = self.client.get(url)['ETag']
+        self.change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200 if modified else 304)
+
+    def check(self, change, modified=True):
+        self.change = change
+        for url in (self.url, '/api/recipes/'):
+            with self.subTest(url=url):
+                self.assertModified(url, modified)
+
+    def test_ingredient_rename(self):
+        def change():
+            ingredient = self.ingredients[0]
+            ingredient.name += ' новое'
+            ingredient.save()
+        self.check(change)
+
+    def test_tag_rename(self):
+        def change():
+            tag = self.tags[0]
+            tag.name += '!'
+            tag.save()
+        self.check(change)
+
+    def test_author_profile(self):
+        def change():
+            self.author.first_name += 'а'
+            self.author.save()
+        self.check(change)
+
+    def test_author_login_keeps_etag(self):
+        def change():
+            self.author.last_login = timezone.now()
+            self.author.save(update_fields=('last_login',))
+        self.check(change, modified=False)
+
+    def test_thumbnails_ready(self):
+        self.assertIsNone(self.client.get(self.url).data['thumbnails'])
+        urls = (self.url, '/api/recipes/')
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        generate_thumbnails(self.recipe.image.name)
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(self.client.get(self.url).data['thumbnails'])
+
+    def test_list_does_not_touch_storage(self):
+        generate_thumbnails(self.recipe.image.name)
+        with mock.patch.object(FileSystemStorage, 'exists') as exists:
+            response = self.client.get('/api/recipes/')
+        self.assertIsNotNone(response.data['results'][0]['thumbnails'])
+        exists.assert_not_called()
+
+    def test_stale_save_restores_thumbnails_source(self):
+        name = self.recipe.image.name
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        generate_thumbnails(name)
+        self.schedule_thumbnails.reset_mock()
+        stale.name = 'Новое название'
+        stale.save()
+        self.schedule_thumbnails.assert_called_once_with(name)
+        with mock.patch('api.images.Image.open') as image_open:
+            generate_thumbnails(name)
+        image_open.assert_not_called()
+        self.recipe.refresh_from_db()
+        self.assertTrue(self.recipe.has_thumbnails)
+        self.schedule_thumbnails.reset_mock()
+        self.recipe.save()
+        self.schedule_thumbnails.assert_not_called()
+
+    def test_ready_thumbnails_are_not_regenerated(self):
+        generate_thumbnails(self.recipe.image.name)
+        with mock.patch('api.images.Image.open') as image_open:
+            generate_thumbnails(self.recipe.image.name)
+        image_open.assert_not_called()
+
+
+class CounterFieldsTest(APITestCase):
+
+    def test_full_save_keeps_counters(self):
+        recipe = self.create_recipe()
+        author = User.objects.get(pk=self.author.pk)
+        stale = Recipe.objects.get(pk=recipe.pk)
+        Favorite.objects.create(user=self.user, recipe=recipe)
+        Follow.objects.create(user=self.user, author=self.author)
+        stale.name = 'Новое название'
+        stale.save()
+        author.first_name = 'Новое имя'
+        author.save()
+        recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(recipe.name, 'Новое название')
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(self.author.first_name, 'Новое имя')
+        self.assertEqual(self.author.recipes_count, 1)
+        self.assertEqual(self.author.followers_count, 1)
+
+
+class TokenAuthenticationTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        CachedTokenAuthentication.local_cache.clear()
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def test_local_cache_is_not_shared(self):
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        self.assertIsNone(cache.get(token_cache_key(self.token.key)))
+
+    def test_unsafe_request_saves_fresh_user(self):
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        # Изменение из другого процесса: сигналы не сбросили кеш.
+        User.objects.filter(pk=self.user.pk).update(first_name='Другое')
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'password',
+            'new_password': 'Zx-very-long-1',
+        })
+        self.assertEqual(response.status_code, 204, response.data)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Другое')
+        self.assertTrue(self.user.check_password('Zx-very-long-1'))
+
+
+class MembershipCacheTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipe()
+        self.url = f'/api/recipes/{self.recipe.id}/favorite/'
+        self.key = MEMBERSHIP_KEY.format(name='favorite',
+                                         user_id=self.user.id)
+
+    def test_local_cache_is_not_trusted(self):
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        # Множество, оставшееся в памяти процесса, который не получил
+        # сброс из другого процесса.
+        cache.set(self.key, frozenset())
+        self.assertEqual(self.client.delete(self.url).status_code, 204)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(MEDIA_ROOT, 'cache'),
+    }})
+    def test_shared_cache_rejects_duplicates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(self.url).status_code, 201)
+        self.assertEqual(self.client.post(self.url).status_code, 400)
+        self.assertIn(self.recipe.id, membership_cache.get(
+            'favorite', self.user.id, lambda: ()))
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 400)
+
+
+class RecipeJSONParserTest(SimpleTestCase):
+
+    def parse(self, payload, chunk_size=RecipeJSONParser.chunk_size):
+        parser = RecipeJSONParser()
+        parser.chunk_size = chunk_size
+        return parser.parse(BytesIO(payload))
+
+    def payload(self, image, prefix='data:image/png;base64,'):
+        encoded = prefix + base64.b64encode(image).decode()
+        return json.dumps({
+            'name': 'Кавычки "image": и \\',
+            'image': encoded,
+            'tags': [1, 2],
+        }).replace('/', '\\/').encode()
+
+    def test_image_is_decoded_in_any_chunks(self):
+        image = noise_png(16, 16)
+        for prefix in ('data:image/png;base64,', ''):
+            payload = self.payload(image, prefix)
+            self.assertIn(b'\\/', payload)
+            for chunk_size in range(1, 8):
+                with self.subTest(prefix=prefix, chunk_size=chunk_size):
+                    data = self.parse(payload, chunk_size)
+                    self.assertEqual(data['name'], 'Кавычки "image": и \\')
+                    self.assertEqual(data['tags'], [1, 2])
+                    self.assertEqual(data['image'].read(), image)
+                    self.assertEqual(data['image'].size, len(image))
+                    self.assertTrue(data['image'].name.endswith('.png'))
+
+    def test_null_image(self):
+        data = self.parse(b'{"name": "x", "image": null}', 3)
+        self.assertIsNone(data['image'])
+
+    def test_invalid_base64(self):
+        for image in ('data:image/png;base64,!!!!', 'data:image/png;base64,'
+                      'iVBORw0KGgo=AAAA', 'не картинка'):
+            with self.subTest(image=image), self.assertRaises(
+                    ValidationError):
+                self.parse(json.dumps({'image': image}).encode(), 5)
+
+    def test_escaped_quote_in_image(self):
+        with self.assertRaises(ValidationError):
+            self.parse(b'{"image": "data:image/png;base64,AAAA\\""}', 4)
+
+    def test_size_limit(self):
+        image = noise_png(32, 32)
+        with override_settings(RECIPE_IMAGE_MAX_SIZE=len(image) - 1):
+            with self.assertRaisesMessage(ValidationError,
+                                          'Картинка слишком большая'):
+                self.parse(self.payload(image), 7)
+
+    def test_pixel_limit_before_full_decode(self):
+        image = noise_png(200, 200)
+        self.assertGreater(len(image), Base64ImageWriter.header_size)
+        # Документ обрывается на середине картинки: ошибка разрешения
+        # означает, что проверка сработала по заголовку.
+        payload = b'{"image": "data:image/png;base64,' + base64.b64encode(
+            image[:Base64ImageWriter.header_size + 3 * 1024])
+        with override_settings(RECIPE_IMAGE_MAX_PIXELS=100 * 100):
+            with self.assertRaisesMessage(
+                    ValidationError, 'Слишком большое разрешение картинки'):
+                self.parse(payload, 7)
+
+    def test_document_size_limit(self):
+        text = 'а' * ImageFieldScanner.max_document_size
+        with self.assertRaises(ParseError):
+            self.parse(json.dumps({'text': text}).encode())
+        # Картинка в размер документа не входит.
+        image = noise_png(600, 600)
+        self.assertGreater(len(image), ImageFieldScanner.max_document_size)
+        self.assertEqual(self.parse(self.payload(image))['image'].size,
+                         len(image))
+
+
+@override_settings(MEDIA_ROOT=os.path.join(MEDIA_ROOT, 'exports-test'))
+class ExportJobTest(TransactionTestCase):
+    # Задачи выполняются в потоке dispatcher и должны видеть данные теста.
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('api.signals.schedule_thumbnails')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, settings.MEDIA_ROOT, True)
+        self.user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        ingredient = Ingredient.objects.create(name='соль',
+                                               measurement_unit='г')
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='Рецепт', image='recipes/image.png',
+            text='Описание', cooking_time=10)
+        IngredientAmount.objects.create(recipe=self.recipe,
+                                        ingredient=ingredient, amount=5)
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipe)
+
+    def files(self):
+        if not default_storage.exists('exports'):
+            return []
+        return default_storage.listdir('exports')[1]
+
+    def wait(self, job_id):
+        for _ in range(200):
+            data = self.client.get(f'/api/exports/{job_id}/').json()
+            if data['status'] in (ExportJob.DONE, ExportJob.FAILED):
+                return data
+            time.sleep(0.05)
+        self.fail('Выгрузка не завершилась')
+
+    def export(self):
+        response = self.client.post('/api/exports/')
+        self.assertIn(response.status_code, (201, 202))
+        return response
+
+    def download(self, job_id):
+        response = self.client.get(f'/api/exports/{job_id}/download/')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_create_poll_download(self):
+        response = self.export()
+        self.assertEqual(response.status_code, 202)
+        self.assertIsNone(response.json()['download_url'])
+        job_id = response.json()['id']
+        data = self.wait(job_id)
+        self.assertEqual(data['status'], ExportJob.DONE)
+        self.assertTrue(data['download_url'].endswith(
+            f'/api/exports/{job_id}/download/'))
+        self.assertTrue(self.download(job_id).startswith(b'%PDF'))
+
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(
+            email='other@example.com', username='other', password='pw'))
+        self.assertEqual(
+            other.get(f'/api/exports/{job_id}/').status_code, 404)
+
+    def test_unchanged_cart_is_not_rendered_again(self):
+        content = self.download(self.wait(self.export().json()['id'])['id'])
+        with mock.patch('api.exports.render_in_process') as render:
+            response = self.export()
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(self.download(response.json()['id']), content)
+            response = self.client.get(
+                '/api/recipes/download_shopping_cart/',
+                HTTP_ACCEPT='application/pdf')
+            self.assertEqual(b''.join(response.streaming_content), content)
+        render.assert_not_called()
+        self.assertEqual(len(self.files()), 1)
+
+        IngredientAmount.objects.filter(recipe=self.recipe).update(amount=7)
+        ShoppingCartItem.objects.filter(user=self.user).update(amount=7)
+        response = self.export()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.wait(response.json()['id'])['status'],
+                         ExportJob.DONE)
+        self.assertEqual(len(self.files()), 2)
+
+    def test_failed_job_and_cleanup(self):
+        job = ExportJob.objects.create(user=self.user)
+        response = self.client.get(f'/api/exports/{job.pk}/download/')
+        self.assertEqual(response.status_code, 400)
+        with mock.patch('api.exports.render_in_process',
+                        side_effect=RuntimeError), \
+                self.assertLogs('api.exports', 'ERROR'):
+            run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.FAILED)
+
+        pending = ExportJob.objects.create(user=self.user,
+                                           status=ExportJob.RUNNING)
+        output = StringIO()
+        call_command('cleanup_exports', '--requeue', stdout=output)
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, ExportJob.DONE)
+        self.assertIn('Выполнено задач: 1', output.getvalue())
+
+        ExportJob.objects.update(
+            created=timezone.now() - timedelta(days=30))
+        os.utime(default_storage.path(pending.file.name), (0, 0))
+        call_command('cleanup_exports', stdout=StringIO())
+        self.assertFalse(ExportJob.objects.exists())
+        self.assertEqual(self.files(), [])
+
+
+class MergeIngredientsTest(TransactionTestCase):
+    # Дубликаты возможны только в базе без ограничения уникальности,
+    # поэтому ограничение снимается на время теста.
+
+    def setUp(self):
+        constraint, = Ingredient._meta.constraints
+        # SQLite пересоздает таблицу по текущему описанию модели.
+        with mock.patch.object(Ingredient._meta, 'constraints', []), \
+                connection.schema_editor() as editor:
+            editor.remove_constraint(Ingredient, constraint)
+        self.addCleanup(self.restore_constraint, constraint)
+        patcher = mock.patch('api.signals.schedule_thumbnails')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def restore_constraint(self, constraint):
+        Ingredient.objects.all().delete()
+        with connection.schema_editor() as editor:
+            editor.add_constraint(Ingredient, constraint)
+
+    def test_duplicates_are_merged(self):
+        author = User.objects.create_user(
+            email='author@example.com', username='author', password='pw')
+        salt, salt_copy, salt_copy2 = [
+            Ingredient.objects.create(name='соль', measurement_unit='г')
+            for _ in range(3)]
+        sugar = Ingredient.objects.create(name='сахар', measurement_unit='г')
+        first, second = [
+            Recipe.objects.create(author=author, name=name,
+                                  image='recipes/image.png', text='Описание',
+                                  cooking_time=10)
+            for name in ('Первый', 'Второй')]
+        IngredientAmount.objects.bulk_create([
+            IngredientAmount(recipe=first, ingredient=salt, amount=5),
+            IngredientAmount(recipe=first, ingredient=salt_copy, amount=3),
+            IngredientAmount(recipe=second, ingredient=salt_copy, amount=2),
+            IngredientAmount(recipe=second, ingredient=salt_copy2, amount=4),
+            IngredientAmount(recipe=second, ingredient=sugar, amount=1),
+        ])
+        first.ingredients.set([salt, salt_copy])
+
+        output = StringIO()
+        call_command('merge_ingredients', '--dry-run', stdout=output)
+        self.assertIn('Дубликатов ингредиентов: 2', output.getvalue())
+        self.assertEqual(Ingredient.objects.count(), 4)
+
+        call_command('merge_ingredients', stdout=StringIO())
+        self.assertEqual(
+            sorted(Ingredient.objects.values_list('pk', flat=True)),
+            [salt.pk, sugar.pk])
+        self.assertEqual(
+            sorted(IngredientAmount.objects.values_list(
+                'recipe__name', 'ingredient__name', 'amount')),
+            [('Второй', 'сахар', 1), ('Второй', 'соль', 6),
+             ('Первый', 'соль', 8)])
+        self.assertEqual(list(first.ingredients.all()), [salt])
@@ -0,0 +1,65 @@
+import logging
+
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.throttling import ScopedRateThrottle
+
+logger = logging.getLogger(__name__)
+
+
+class SlidingWindowThrottle(ScopedRateThrottle):
+    """Ограничение частоты по скользящему окну для каждого пользователя.
+
+    Хранит два счетчика: текущего и предыдущего окна; запросы прошлого
+    окна учитываются с весом, убывающим по мере его удаления. В отличие
+    от журнала меток времени SimpleRateThrottle, запись в кеш одна -
+    атомарный incr. Если общий кеш недоступен, счетчики ведутся
+    в памяти процесса.
+    """
+    fallback_cache = LocMemCache('api-throttle', {})
+
+    def allow_request(self, request, view):
+        self.scope = getattr(view, self.scope_attr, None)
+        if not self.scope:
+            return True
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        self.now = self.timer()
+        try:
+            return self.check(self.cache)
+        except Exception:
+            logger.warning('Кеш недоступен, ограничение частоты '
+                           'считается в памяти процесса', exc_info=True)
+            return self.check(self.fallback_cache)
+
+    def check(self, counters):
+        window, elapsed = divmod(self.now, self.duration)
+        current_key = f'{self.key}_{int(window)}'
+        previous_key = f'{self.key}_{int(window) - 1}'
+        counts = counters.get_many((previous_key, current_key))
+        self.previous = counts.get(previous_key, 0)
+        self.current = counts.get(current_key, 0)
+        self.elapsed = elapsed
+        weight = 1 - elapsed / self.duration
+        if self.previous * weight + self.current >= self.num_requests:
+            return self.throttle_failure()
+        # Ключ живет два окна: в следующем он станет предыдущим.
+        counters.add(current_key, 0, 2 * self.duration)
+        counters.incr(current_key)
+        return self.throttle_success()
+
+    def throttle_success(self):
+        return True
+
+    def wait(self):
+        remaining = self.duration - self.elapsed
+        if self.current >= self.num_requests or not self.previous:
+            return remaining
+        # Через сколько вес предыдущего окна упадет настолько, что
+        # освободится место для одного запроса.
+        allowed = (self.num_requests - self.current) / self.previous
+        return max(0, self.duration * (1 - allowed) - self.elapsed)
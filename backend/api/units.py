@@ -0,0 +1,29 @@
+import re
+
+# Единица измерения -> (каноническая единица, множитель). Переводятся
+# только единицы с однозначным коэффициентом: граммы и миллилитры
+# между собой не пересчитываются, штуки и "по вкусу" остаются как есть.
+UNIT_CONVERSIONS = {
+    'г': ('г', 1),
+    'кг': ('г', 1000),
+    'мл': ('мл', 1),
+    'л': ('мл', 1000),
+    'стакан': ('мл', 200),
+    'ст. л.': ('мл', 15),
+    'ч. л.': ('мл', 5),
+}
+
+SEPARATORS = re.compile(r'[\s.]+')
+
+
+def unit_key(unit):
+    # "ст.л.", "Ст. л." и "ст л" - одна и та же единица.
+    return SEPARATORS.sub('', unit.casefold())
+
+
+CONVERSIONS = {unit_key(unit): conversion
+               for unit, conversion in UNIT_CONVERSIONS.items()}
+
+
+def normalize_unit(unit):
+    return CONVERSIONS.get(unit_key(unit), (unit.strip(), 1))
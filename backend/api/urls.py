@@ -1,9 +1,10 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import (DownloadShoppingCart, FollowUnfollowViewSet,
-                    IngredientViewSet, ProfileViewSet, RecipeViewSet,
-                    SubscribersViewSet, TagViewSet)
+from .async_views import async_view, export_executor
+from .views import (DownloadShoppingCart, ExportJobViewSet,
+                    FollowUnfollowViewSet, IngredientViewSet, ProfileViewSet,
+                    RecipeViewSet, SubscribersViewSet, TagViewSet)
 
 router = DefaultRouter()
 router.register(r'users/subscriptions', SubscribersViewSet,
@@ -12,6 +13,7 @@ router.register(r'users', ProfileViewSet, basename='users')
 router.register(r'tags', TagViewSet, basename='tags')
 router.register(r'ingredients', IngredientViewSet, basename='ingredients')
 router.register(r'recipes', RecipeViewSet, basename='recipes')
+router.register(r'exports', ExportJobViewSet, basename='exports')
 
 
 urlpatterns = [
@@ -23,3 +25,31 @@ urlpatterns = [
          FollowUnfollowViewSet.as_view(),
          name='subscribe'),
 ]
+
+# Асинхронные варианты читающих эндпоинтов, их подключает только
+# foodgram/asgi.py. Остальные адреса обслуживаются как обычно.
+async_urlpatterns = [
+    path('recipes/download_shopping_cart/',
+         async_view(DownloadShoppingCart.as_view(), export_executor)),
+    path('recipes/',
+         async_view(RecipeViewSet.as_view(
+             {'get': 'list', 'post': 'create'},
+             basename='recipes', detail=False))),
+    path('recipes/<int:pk>/',
+         async_view(RecipeViewSet.as_view(
+             {'get': 'retrieve', 'patch': 'partial_update',
+              'delete': 'destroy'},
+             basename='recipes', detail=True))),
+    path('tags/',
+         async_view(TagViewSet.as_view(
+             {'get': 'list'}, basename='tags', detail=False))),
+    path('tags/<int:pk>/',
+         async_view(TagViewSet.as_view(
+             {'get': 'retrieve'}, basename='tags', detail=True))),
+    path('ingredients/',
+         async_view(IngredientViewSet.as_view(
+             {'get': 'list'}, basename='ingredients', detail=False))),
+    path('ingredients/<int:pk>/',
+         async_view(IngredientViewSet.as_view(
+             {'get': 'retrieve'}, basename='ingredients', detail=True))),
+]
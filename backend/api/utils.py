@@ -0,0 +1,11 @@
+from itertools import islice
+
+
+def batched(rows, size):
+    """Разбивает итерируемый объект на списки не длиннее size."""
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
@@ -1,29 +1,45 @@
-import io
+from calendar import timegm
 
+from django.core.files.storage import default_storage
 from django.db import IntegrityError
-from django.db.models import Sum
-from django.http import FileResponse
-from django.shortcuts import get_object_or_404
+from django.db.models import BooleanField, Value
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.units import inch
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfgen import canvas
-from rest_framework import filters, permissions, status, viewsets
+from rest_framework import (filters, mixins, parsers, permissions, status,
+                            viewsets)
 from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .filters import IngredientFilter, RecipeFilter
-from .models import (Favorite, Follow, Ingredient, IngredientAmount, Recipe,
+from .cache import catalog_cache, make_etag, membership_cache
+from .exports import cached_export, create_job
+from .feeds import get_recipes_limit, latest_recipes
+from .filters import POPULAR_ORDERING, IngredientFilter, RecipeFilter
+from .models import (ExportJob, Favorite, Follow, Ingredient, Recipe,
                      ShoppingCart, Tag, User)
+from .pagination import CursorPaginationMixin
+from .parsers import RecipeJSONParser
 from .permissions import IsOwnerOrAdminOrReadOnly
-from .serializers import (FollowUnfollowSerializer, IngredientSerializer,
-                          ProfileSerializer, RecipeCreateSerializer,
-                          RecipeInfoSerializer, RecipeSerializer,
-                          SubscribersSerializer, TagSerializer)
+from .renderers import SHOPPING_LIST_RENDERERS
+from .serializers import (ExportJobSerializer, FollowUnfollowSerializer,
+                          IngredientSerializer, ProfileSerializer,
+                          RecipeCreateSerializer, RecipeInfoSerializer,
+                          RecipeSerializer, SubscribersSerializer,
+                          TagSerializer)
+from .shopping_list import get_shopping_list
+from .throttling import SlidingWindowThrottle
+
+
+def get_members(request, name, model, field):
+    return membership_cache.get(
+        name, request.user.pk,
+        lambda: model.objects.filter(user=request.user).values_list(
+            field, flat=True))
 
 
 class ProfileViewSet(UserViewSet):
@@ -42,29 +58,59 @@ class ProfileViewSet(UserViewSet):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
-class SubscribersViewSet(viewsets.ReadOnlyModelViewSet):
+class SubscribersViewSet(CursorPaginationMixin,
+                         viewsets.ReadOnlyModelViewSet):
     queryset = User.objects.all()
     serializer_class = SubscribersSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_queryset(self):
         user = self.request.user
-        return User.objects.filter(following__user=user)
+        return User.objects.filter(following__user=user).annotate(
+            is_subscribed_annotated=Value(True, output_field=BooleanField())
+        ).order_by('-id')
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['recipes_by_author'] = getattr(
+            self, 'recipes_by_author', None)
+        return context
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        authors = list(queryset) if page is None else page
+        self.recipes_by_author = latest_recipes(
+            [author.id for author in authors], get_recipes_limit(request))
+        serializer = self.get_serializer(authors, many=True)
+        if page is None:
+            return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
 
 
 class FollowUnfollowViewSet(APIView):
     queryset = Follow.objects.all()
     serializer_class = FollowUnfollowSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = (SlidingWindowThrottle,)
+    throttle_scope = 'follow'
+
+    def get_members(self, request):
+        return get_members(request, self.throttle_scope, Follow, 'author_id')
 
     def post(self, request, author_id):
+        members = self.get_members(request)
+        if members is not None and author_id in members:
+            return Response('Вы уже подписаны на этого пользователя',
+                            status=status.HTTP_400_BAD_REQUEST)
         author = get_object_or_404(User, id=author_id)
         if request.user == author:
             return Response('Вы не можете подписаться на себя',
                             status=status.HTTP_400_BAD_REQUEST)
         try:
             Follow.objects.create(user=request.user, author=author)
-            serializer = SubscribersSerializer(author)
+            serializer = SubscribersSerializer(
+                author, context={'request': request})
             return Response(serializer.data, status.HTTP_201_CREATED)
         except IntegrityError:
             return Response('Вы уже подписаны на этого пользователя',
@@ -72,6 +118,10 @@ class FollowUnfollowViewSet(APIView):
 
     def delete(self, request, author_id):
         author = get_object_or_404(User, id=author_id)
+        members = self.get_members(request)
+        if members is not None and author.id not in members:
+            return Response('Вы не подписаны на этого пользователя',
+                            status=status.HTTP_400_BAD_REQUEST)
         try:
             object = Follow.objects.get(user=request.user, author=author)
             object.delete()
@@ -81,36 +131,129 @@ class FollowUnfollowViewSet(APIView):
                             status=status.HTTP_400_BAD_REQUEST)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class CatalogCacheMixin:
+    catalog_name = None
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params:
+            return super().list(request, *args, **kwargs)
+        content, etag = catalog_cache.get(
+            self.catalog_name,
+            lambda: JSONRenderer().render(
+                self.get_serializer(self.get_queryset(), many=True).data))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(content,
+                                    content_type=JSONRenderer.media_type)
+        response['ETag'] = etag
+        return response
+
+
+class TagViewSet(CatalogCacheMixin, viewsets.ReadOnlyModelViewSet):
+    catalog_name = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(CatalogCacheMixin, viewsets.ReadOnlyModelViewSet):
+    catalog_name = 'ingredients'
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
     filterset_class = IngredientFilter
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(CursorPaginationMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     http_method_names = ('get', 'post', 'patch', 'delete')
     filter_backends = [DjangoFilterBackend, ]
     filterset_class = RecipeFilter
     serializer_class = RecipeCreateSerializer
+    parser_classes = (RecipeJSONParser, parsers.FormParser,
+                      parsers.MultiPartParser)
     permission_classes = (IsOwnerOrAdminOrReadOnly,)
+    throttle_scope = None
+
+    validator_fields = ('id', 'updated_at', 'is_favorited_annotated',
+                        'is_in_shopping_cart_annotated',
+                        'is_subscribed_annotated')
+
+    def get_queryset(self):
+        return Recipe.objects.with_related().with_user_flags(
+            self.request.user)
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return RecipeSerializer
         return RecipeCreateSerializer
 
+    @property
+    def cursor_ordering(self):
+        if self.request.query_params.get('ordering') == 'popular':
+            return POPULAR_ORDERING
+        return None
+
+    def get_validator_queryset(self):
+        return Recipe.objects.with_user_flags(self.request.user).values(
+            *self.validator_fields)
+
+    def get_conditional_response(self, request, data, last_modified):
+        etag = make_etag(repr(data).encode())
+        if request.user.is_authenticated or last_modified is None:
+            last_modified = None
+        else:
+            last_modified = timegm(last_modified.utctimetuple())
+        response = get_conditional_response(request, etag=etag,
+                                            last_modified=last_modified)
+        return response, etag, last_modified
+
+    def set_validators(self, response, etag, last_modified):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_validator_queryset())
+        paginator = type(self.paginator)()
+        rows = paginator.paginate_queryset(queryset, request, view=self)
+        data = paginator.get_paginated_response(rows).data
+        last_modified = max((row['updated_at'] for row in rows),
+                            default=None)
+        response, etag, last_modified = self.get_conditional_response(
+            request, data, last_modified)
+        if response is None:
+            # Страница уже выбрана проверочным запросом: полные строки
+            # читаются по ее id, без повторных COUNT и LIMIT/OFFSET.
+            ids = [row['id'] for row in rows]
+            recipes = self.get_queryset().in_bulk(ids)
+            serializer = self.get_serializer(
+                [recipes[pk] for pk in ids if pk in recipes], many=True)
+            response = paginator.get_paginated_response(serializer.data)
+        return self.set_validators(response, etag, last_modified)
+
+    def retrieve(self, request, *args, **kwargs):
+        validators = get_object_or_404(self.get_validator_queryset(),
+                                       pk=kwargs['pk'])
+        response, etag, last_modified = self.get_conditional_response(
+            request, validators, validators['updated_at'])
+        if response is None:
+            response = super().retrieve(request, *args, **kwargs)
+        return self.set_validators(response, etag, last_modified)
+
     def perform_create(self, serializer):
         return super().perform_create(serializer)
 
-    def favorite_and_shopping_cart(self, request, model, recipe):
+    def favorite_and_shopping_cart(self, request, model, pk):
+        members = get_members(request, self.action, model, 'recipe_id')
+        # Повторное нажатие отклоняется по кешу, без загрузки рецепта.
+        if (request.method == 'POST' and members is not None
+                and pk.isdigit() and int(pk) in members):
+            return Response('Уже добавлено',
+                            status=status.HTTP_400_BAD_REQUEST)
+        recipe = get_object_or_404(Recipe, id=pk)
         if request.method == 'POST':
             try:
                 model.objects.create(user=request.user, recipe=recipe)
@@ -121,6 +264,9 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 return Response('Уже добавлено',
                                 status=status.HTTP_400_BAD_REQUEST)
         if request.method == 'DELETE':
+            if members is not None and recipe.id not in members:
+                return Response('Не добавлено',
+                                status=status.HTTP_400_BAD_REQUEST)
             try:
                 object = model.objects.get(user=request.user,
                                            recipe=recipe)
@@ -135,72 +281,79 @@ class RecipeViewSet(viewsets.ModelViewSet):
     @action(detail=True,
             methods=('post', 'delete'),
             serializer_class=RecipeInfoSerializer,
-            permission_classes=(permissions.IsAuthenticated,))
+            permission_classes=(permissions.IsAuthenticated,),
+            throttle_classes=(SlidingWindowThrottle,),
+            throttle_scope='shopping_cart')
     def shopping_cart(self, request, pk):
-        recipe = get_object_or_404(Recipe, id=pk)
-        return self.favorite_and_shopping_cart(request, ShoppingCart, recipe)
+        return self.favorite_and_shopping_cart(request, ShoppingCart, pk)
 
     @action(detail=True,
             methods=('post', 'delete'),
             serializer_class=RecipeInfoSerializer,
-            permission_classes=(permissions.IsAuthenticated,))
+            permission_classes=(permissions.IsAuthenticated,),
+            throttle_classes=(SlidingWindowThrottle,),
+            throttle_scope='favorite')
     def favorite(self, request, pk):
-        recipe = get_object_or_404(Recipe, id=pk)
-        return self.favorite_and_shopping_cart(request, Favorite, recipe)
+        return self.favorite_and_shopping_cart(request, Favorite, pk)
 
 
 class DownloadShoppingCart(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+    renderer_classes = SHOPPING_LIST_RENDERERS
+
+    def handle_exception(self, exc):
+        self.request.accepted_renderer = JSONRenderer()
+        self.request.accepted_media_type = JSONRenderer.media_type
+        return super().handle_exception(exc)
 
     def get(self, request):
-        def shopping_list_struct(unit, amount):
-            return unit, amount
-
-        buf = io.BytesIO()
-        c = canvas.Canvas(buf, pagesize=letter, bottomup=0)
-        textob = c.beginText()
-        textob.setTextOrigin(inch, inch)
-        pdfmetrics.registerFont(TTFont(
-            'FreeSans',
-            'FreeSans.ttf'))
-        textob.setFont('FreeSans', 15)
-        shopping_cart = ShoppingCart.objects.filter(user=request.user).values()
-        shopping_list_name = []
-        shopping_list_amount = []
-        ingredients = Recipe.objects.filter(
-            in_shopping_cart__user=request.user).values(
-                'ingredients__name',
-                'ingredients__measurement_unit',
-                'ingredientamount__amount'
-                ).order_by(
-            'ingredients__name').annotate(
-                total_amount=Sum(
-                    'ingredientamount__amount'))
-        for recipe in shopping_cart:
-            ingredient = IngredientAmount.objects.get(
-                recipe=recipe['recipe_id'])
-            if ingredient.ingredient.name not in shopping_list_name:
-                shopping_list_name.append(ingredient.ingredient.name)
-            shopping_list_amount.append(
-                list(shopping_list_struct(ingredient.ingredient.
-                                          measurement_unit,
-                                          ingredient.amount)))
-        index = 1
-        for ingredient in ingredients:
-            total = ingredient['total_amount']
-            if index % 37 == 0:
-                c.drawText(textob)
-                c.showPage()
-                textob = c.beginText()
-                textob.setTextOrigin(inch, inch)
-                textob.setFont('FreeSans', 15)
-            textob.textLine(
-                f'{shopping_list_name[index-1].capitalize()}'
-                f'({shopping_list_amount[index-1][0]})'
-                f' - {total}')
-            index += 1
-        c.drawText(textob)
-        c.showPage()
-        c.save()
-        buf.seek(0)
-        return FileResponse(buf, as_attachment=True,
-                            filename='shopping_list.pdf')
+        renderer = request.accepted_renderer
+        # Под ASGI потоковый ответ отдается из цикла событий, где
+        # обращаться к базе нельзя, поэтому строки читаются заранее.
+        # Их не больше, чем разных ингредиентов в корзине.
+        ingredients = list(get_shopping_list(request.user))
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        if renderer.cached:
+            # Фронтенд ждет файл в ответе, поэтому при промахе кэша запрос
+            # дожидается сборки в пуле процессов, а не ставит задачу.
+            name = cached_export(ingredients)
+            response = FileResponse(default_storage.open(name),
+                                    content_type=content_type)
+        elif renderer.streaming:
+            response = StreamingHttpResponse(renderer.stream(ingredients),
+                                             content_type=content_type)
+        else:
+            response = HttpResponse(renderer.render(ingredients),
+                                    content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{renderer.format}"')
+        return response
+
+
+class ExportJobViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                       viewsets.GenericViewSet):
+    serializer_class = ExportJobSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_queryset(self):
+        return ExportJob.objects.filter(user=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        job = create_job(request.user)
+        serializer = self.get_serializer(job)
+        if job.status == ExportJob.DONE:
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True,
+            methods=('get',))
+    def download(self, request, pk):
+        job = self.get_object()
+        if job.status != ExportJob.DONE:
+            return Response('Файл еще не готов',
+                            status=status.HTTP_400_BAD_REQUEST)
+        return FileResponse(job.file.open('rb'), as_attachment=True,
+                            filename='shopping_list.pdf',
+                            content_type='application/pdf')
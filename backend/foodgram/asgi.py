@@ -0,0 +1,21 @@
+import os
+
+import django
+from django.core.handlers.asgi import ASGIHandler
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+
+
+class FoodgramASGIHandler(ASGIHandler):
+    """ASGIHandler с асинхронными вариантами читающих эндпоинтов."""
+    urlconf = 'foodgram.asgi_urls'
+
+    def create_request(self, scope, body_file):
+        request, error_response = super().create_request(scope, body_file)
+        if request is not None:
+            request.urlconf = self.urlconf
+        return request, error_response
+
+
+django.setup(set_prefix=False)
+application = FoodgramASGIHandler()
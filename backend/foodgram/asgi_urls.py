@@ -0,0 +1,10 @@
+from django.urls import include, path
+
+from api.urls import async_urlpatterns
+
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('api/', include(async_urlpatterns)),
+    *sync_urlpatterns,
+]
@@ -0,0 +1,143 @@
+import os
+import threading
+
+from django.db.backends.postgresql import base, creation
+from psycopg2 import extras, pool
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class BlockingConnectionPool(pool.ThreadedConnectionPool):
+    """Пул, который открывает соединения по мере надобности и ждет
+    свободного соединения, а не падает с PoolError.
+
+    Потоков в процессе (пулы ASGI, выгрузок, миниатюр) может быть больше,
+    чем соединений: лишние потоки ждут до timeout секунд.
+    """
+
+    def __init__(self, maxconn, timeout, *args, **kwargs):
+        super().__init__(0, maxconn, *args, **kwargs)
+        # psycopg2 держит в пуле не больше minconn свободных соединений
+        # и открывает minconn сразу, поэтому предел задается после
+        # создания пула.
+        self.minconn = maxconn
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self, key=None):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise pool.PoolError(
+                f'connection pool exhausted after {self.timeout}s')
+        try:
+            return super().getconn(key)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        super().putconn(conn, key, close)
+        self._slots.release()
+
+
+def close_pool(alias):
+    with _pools_lock:
+        connections = _pools.pop((alias, os.getpid()), None)
+    if connections is not None:
+        connections.closeall()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Свободные соединения пула держат тестовую базу открытой.
+        close_pool(self.connection.alias)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """Стандартный бэкенд PostgreSQL с проверкой соединений и пулом.
+
+    CONN_HEALTH_CHECKS работает как одноименная настройка Django 4.1:
+    постоянное соединение проверяется перед первым использованием
+    в очередном запросе. POOL_SIZE больше нуля включает пул соединений
+    psycopg2 на процесс: соединения открываются при первом обращении,
+    а закрытое соединение возвращается в пул, а не разрывается. Когда
+    все POOL_SIZE соединений заняты, поток ждет свободное не дольше
+    POOL_TIMEOUT секунд.
+    """
+    creation_class = DatabaseCreation
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_enabled = self.settings_dict.get(
+            'CONN_HEALTH_CHECKS', False)
+        self.health_check_done = False
+        self.pool_size = self.settings_dict.get('POOL_SIZE') or 0
+        self.pool_timeout = self.settings_dict.get('POOL_TIMEOUT', 30)
+
+    def get_pool(self, conn_params):
+        key = (self.alias, os.getpid())
+        with _pools_lock:
+            if key not in _pools:
+                _pools[key] = BlockingConnectionPool(
+                    self.pool_size, self.pool_timeout, **conn_params)
+            return _pools[key]
+
+    def get_new_connection(self, conn_params):
+        if not self.pool_size:
+            return super().get_new_connection(conn_params)
+        connections = self.get_pool(conn_params)
+        connection = connections.getconn()
+        if self.health_check_enabled and not self.is_pooled_usable(connection):
+            connections.putconn(connection, close=True)
+            connection = connections.getconn()
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = options.get(
+            'isolation_level', connection.isolation_level)
+        if self.isolation_level != connection.isolation_level:
+            connection.set_session(isolation_level=self.isolation_level)
+        extras.register_default_jsonb(conn_or_curs=connection,
+                                      loads=lambda x: x)
+        return connection
+
+    def _close(self):
+        if not self.pool_size or self.connection is None:
+            return super()._close()
+        connections = _pools.get((self.alias, os.getpid()))
+        if connections is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            connections.putconn(
+                self.connection,
+                close=bool(self.connection.closed) or self.errors_occurred)
+
+    @staticmethod
+    def is_pooled_usable(connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            connection.rollback()
+        except base.Database.Error:
+            return False
+        return True
+
+    def connect(self):
+        # Новое соединение проверять не нужно, а connect() сам вызывает
+        # ensure_connection() при настройке autocommit.
+        self.health_check_done = True
+        super().connect()
+
+    def ensure_connection(self):
+        if (self.connection is not None and self.health_check_enabled
+                and not self.health_check_done
+                and not self.in_atomic_block):
+            if not self.is_usable():
+                self.errors_occurred = True
+                self.close()
+            self.health_check_done = True
+        super().ensure_connection()
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
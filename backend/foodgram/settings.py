@@ -28,6 +28,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.ProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -57,12 +58,69 @@ TEMPLATES = [
 WSGI_APPLICATION = 'foodgram.wsgi.application'
 
 
-DATABASES = {
+DB_ENGINE = os.getenv('DB_ENGINE', default='django.db.backends.sqlite3')
+
+if DB_ENGINE == 'django.db.backends.sqlite3':
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        }
+    }
+else:
+    # Пул соединений psycopg2 на процесс; при POOL_SIZE больше нуля
+    # соединение возвращается в пул в конце каждого запроса.
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', default=0))
+    # Сколько секунд поток ждет свободное соединение из пула.
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', default=30))
+    # Ограничение времени выполнения запроса в миллисекундах.
+    DB_STATEMENT_TIMEOUT = int(os.getenv('DB_STATEMENT_TIMEOUT',
+                                         default=30000))
+    # Цена случайного чтения для планировщика. Для SSD подходит 1.1:
+    # поиск рецептов тогда соединяет найденные документы с рецептами
+    # по индексу, а не перебором всей таблицы.
+    DB_RANDOM_PAGE_COST = os.getenv('DB_RANDOM_PAGE_COST')
+    DB_OPTIONS = f'-c statement_timeout={DB_STATEMENT_TIMEOUT}'
+    if DB_RANDOM_PAGE_COST:
+        DB_OPTIONS += f' -c random_page_cost={float(DB_RANDOM_PAGE_COST)}'
+    DATABASES = {
+        'default': {
+            'ENGINE': ('foodgram.postgresql'
+                       if DB_ENGINE == 'django.db.backends.postgresql'
+                       else DB_ENGINE),
+            'NAME': os.getenv('POSTGRES_NAME',
+                              default=os.getenv('POSTGRES_DB',
+                                                default='postgres')),
+            'USER': os.getenv('POSTGRES_USER', default='postgres'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD', default=''),
+            'HOST': os.getenv('DB_HOST', default='localhost'),
+            'PORT': os.getenv('DB_PORT', default='5432'),
+            'CONN_MAX_AGE': (0 if DB_POOL_SIZE else
+                             int(os.getenv('DB_CONN_MAX_AGE', default=60))),
+            'CONN_HEALTH_CHECKS': os.getenv(
+                'DB_CONN_HEALTH_CHECKS', default='1') == '1',
+            'POOL_SIZE': DB_POOL_SIZE,
+            'POOL_TIMEOUT': DB_POOL_TIMEOUT,
+            'OPTIONS': {
+                'options': DB_OPTIONS,
+            },
+        }
+    }
+
+# Общий кеш процессов: токены, справочники, счетчики ограничения частоты
+# и множества избранного. Например, CACHE_BACKEND=django.core.cache.
+# backends.memcached.PyMemcacheCache и CACHE_LOCATION=memcached:11211.
+# С LocMemCache по умолчанию у каждого процесса свой кеш, и api.cache
+# не полагается на него при сбросе данных между процессами.
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', default=''),
     }
 }
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation'
@@ -100,6 +158,56 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static_files')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', default=2))
+RECIPE_IMAGE_MAX_SIZE = int(os.getenv('RECIPE_IMAGE_MAX_SIZE',
+                                      default=10 * 1024 * 1024))
+RECIPE_IMAGE_MAX_PIXELS = int(os.getenv('RECIPE_IMAGE_MAX_PIXELS',
+                                        default=40_000_000))
+
+# За сколько последних дней учитываются добавления в избранное и корзину
+# при расчете популярности рецептов (manage.py refresh_popularity).
+POPULARITY_WINDOW_DAYS = int(os.getenv('POPULARITY_WINDOW_DAYS', default=30))
+
+# Размеры пулов потоков для представлений под ASGI (foodgram/asgi.py):
+# читающие эндпоинты и выгрузки списка покупок работают в разных пулах.
+ASYNC_VIEW_THREADS = int(os.getenv('ASYNC_VIEW_THREADS', default=16))
+EXPORT_THREADS = int(os.getenv('EXPORT_THREADS', default=4))
+
+# Фоновые выгрузки списка покупок в PDF (api/exports.py): число процессов
+# для сборки файлов и сколько дней хранятся задачи и готовые файлы.
+EXPORT_PROCESSES = int(os.getenv('EXPORT_PROCESSES', default=2))
+EXPORT_MAX_AGE_DAYS = int(os.getenv('EXPORT_MAX_AGE_DAYS', default=7))
+
+# Лимит на добавление и удаление из избранного, корзины и подписок
+# для одного пользователя, например 30/min (api/throttling.py).
+TOGGLE_THROTTLE_RATE = os.getenv('TOGGLE_THROTTLE_RATE', default='30/min')
+
+# Доля запросов, для которых считаются запросы к базе и время
+# сериализации (заголовок Server-Timing и лог api.middleware).
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE',
+                                        default=0.01))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'profiling': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'message',
+        },
+    },
+    'loggers': {
+        'api.middleware': {
+            'handlers': ['profiling'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
@@ -109,8 +217,13 @@ REST_FRAMEWORK = {
         'django_filters.rest_framework.DjangoFilterBackend',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS': 'api.pagination.CustomPagination',
-    'PAGE_SIZE': 6
+    'PAGE_SIZE': 6,
+    'DEFAULT_THROTTLE_RATES': {
+        'favorite': TOGGLE_THROTTLE_RATE,
+        'shopping_cart': TOGGLE_THROTTLE_RATE,
+        'follow': TOGGLE_THROTTLE_RATE,
+    },
 }
@@ -4,7 +4,8 @@ from .models import User
 
 
 class UserAdmin(admin.ModelAdmin):
-    list_display = ('email', 'username', 'first_name', 'last_name')
+    list_display = ('email', 'username', 'first_name', 'last_name',
+                    'recipes_count', 'followers_count')
     list_filter = ('email', 'username')
 
 
@@ -2,11 +2,41 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 
 
-class User(AbstractUser):
+class CountersMixin:
+    """Не дает полному save() перезаписать денормализованные счетчики.
+
+    Счетчики меняются только через F() в сигналах и командой recount;
+    экземпляр в памяти может хранить устаревшее значение, поэтому при
+    сохранении существующей строки они исключаются из update_fields.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if self._state.adding or kwargs.get('force_insert'):
+            return super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred
+            ]
+        kwargs['update_fields'] = [
+            name for name in update_fields
+            if name not in self.counter_fields
+        ]
+        return super().save(*args, **kwargs)
+
+
+class User(CountersMixin, AbstractUser):
     email = models.EmailField(unique=True)
     username = models.CharField(max_length=255, unique=True)
     first_name = models.CharField(max_length=150)
     last_name = models.CharField(max_length=150)
+    recipes_count = models.PositiveIntegerField(default=0, editable=False)
+    followers_count = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('recipes_count', 'followers_count')
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']